@@ -0,0 +1,127 @@
+# batching.py
+import asyncio
+import logging
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent handlers into small batches.
+    A batch is flushed when it reaches max_batch_size or when the oldest
+    item has waited max_wait seconds. run_batch is an async callable that
+    takes a list of items and returns a list of results in the same order.
+    Up to `concurrency` batches may be running at the same time.
+    """
+
+    def __init__(self, run_batch, max_batch_size: int = 8, max_wait: float = 0.05,
+                 concurrency: int = 1, name: str = "batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.concurrency = max(1, concurrency)
+        self.name = name
+        self._queue = None
+        self._wakeup = None
+        self._worker = None
+        self._slots = None
+        self._running = set()
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of items waiting to be put into a batch"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._worker = asyncio.create_task(self._run(), name=f"{self.name}-worker")
+
+    async def submit(self, item):
+        """Queue an item and wait for its result"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        self._wakeup.set()
+        return await future
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._running):
+            task.cancel()
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if self._queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            batch.append(self._queue.get_nowait())
+        # Те, кто уже отменил ожидание, в батч не попадают
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, batch: list):
+        items = [item for item, _ in batch]
+        self.batches += 1
+        self.items += len(items)
+        self.in_flight += len(items)
+        try:
+            results = await self.run_batch(items)
+        except Exception as e:
+            logging.error(f"{self.name}: batch of {len(items)} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.in_flight -= len(items)
+            self._slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,426 @@
+# bench.py
+"""
+Load/latency benchmark. Everything runs locally: a fake Telegram Bot API
+(fake_telegram.py), a fake Wikipedia API (fake_wiki.py) and SQLite for orders
+and FSM state, all in a temporary directory.
+
+    python bench.py run --app main --users 20 --actions 10 --json new.json
+    python bench.py run --replay updates.jsonl        # recorded raw updates, one per line
+    python bench.py micro --json micro.json
+    python bench.py compare old.json new.json
+
+`run` feeds updates through the app's real Dispatcher (create_dispatcher,
+startup/shutdown from main.py or main_bot.py) and reports throughput,
+p50/p95/p99 latency per path (text, order, photo) and peak RSS; `--micro`
+adds the micro-benchmarks to the same report.
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+TEXT_MESSAGES = [
+    "Tell me about the Eiffel Tower",
+    "What do you know about the history of Rome",
+    "Who was Albert Einstein",
+    "Tell me about quantum computing",
+    "What is the capital of France",
+    "Tell me about mercury",
+    "asdfgh",
+]
+# Сценарии заказа: в main.py заказ идёт через /pizza, в main_bot.py — одной фразой
+ORDER_SCRIPTS = {
+    "main": [["/pizza", "pepperoni", "2"], ["/pizza", "margherita please", "three"], ["/pizza", "veggie", "1"]],
+    "main_bot": [["I want 2 pepperoni pizzas"], ["I'd like 3 margherita pizzas"], ["I need a vegetarian pizza"]],
+}
+MENU_QUERIES = ["pepperoni", "peperoni", "margarita", "veggie", "vegetarian pizza", "meat lovers", "hawaiian"]
+DEFAULT_MIX = "text=0.5,order=0.3,photo=0.2"
+
+
+# === Статистика ===
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def summarize(samples: list, scale: float, unit: str) -> dict:
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        f"mean_{unit}": round(sum(values) / len(values) * scale, 3),
+        f"p50_{unit}": round(percentile(values, 0.50) * scale, 3),
+        f"p95_{unit}": round(percentile(values, 0.95) * scale, 3),
+        f"p99_{unit}": round(percentile(values, 0.99) * scale, 3),
+        f"max_{unit}": round(values[-1] * scale, 3),
+    }
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss в Linux — в килобайтах; children — уже завершённые пулы BLIP/spaCy
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "func"},
+    }
+
+
+# === Окружение ===
+def configure_env(args, workdir: str):
+    """Point every backend at local stand-ins; must run before the bot modules are imported"""
+    os.environ.update({
+        "BOT_API_KEY": "123456:bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.telegram_port}",
+        "WIKI_API_URL": f"http://127.0.0.1:{args.wiki_port}/w/api.php",
+        "WIKI_BACKEND": "remote",
+        "ORDER_STORE": "sqlite",
+        "ORDER_SQLITE_PATH": os.path.join(workdir, "orders.db"),
+        "ORDER_JOURNAL_PATH": os.path.join(workdir, "orders.journal"),
+        "FSM_STORAGE": "sqlite",
+        "FSM_DB_PATH": os.path.join(workdir, "fsm.db"),
+        "CAPTION_CACHE_PATH": os.path.join(workdir, "captions.json"),
+        "METRICS_PORT": "0",
+    })
+    if not args.send_limits:
+        # Без лимитов Telegram задержки показывают сам бот, а не ограничитель отправки
+        for name in ("CHAT", "GROUP", "GLOBAL"):
+            os.environ[f"SEND_{name}_RATE"] = os.environ[f"SEND_{name}_BURST"] = "1000000"
+
+
+def make_photos(count: int) -> dict:
+    from PIL import Image
+    rng = random.Random(0)
+    photos = {}
+    for index in range(count):
+        image = Image.new("RGB", (320, 240), tuple(rng.randrange(256) for _ in range(3)))
+        for _ in range(20):
+            x, y = rng.randrange(300), rng.randrange(220)
+            image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 20, y + 20))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG")
+        photos[f"photo{index}"] = buffer.getvalue()
+    return photos
+
+
+# === Сценарии ===
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def synthetic_sessions(args, photo_ids: list) -> list:
+    """[(chat_id, [(path, text or None, file_id or None), ...]), ...] from the --mix weights"""
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    paths, probabilities = list(weights), list(weights.values())
+    scripts = ORDER_SCRIPTS.get(args.app, ORDER_SCRIPTS["main"])
+    sessions = []
+    for user in range(args.users):
+        steps = []
+        for path in rng.choices(paths, probabilities, k=args.actions):
+            if path == "text":
+                steps.append(("text", rng.choice(TEXT_MESSAGES), None))
+            elif path == "order":
+                steps += [("order", text, None) for text in rng.choice(scripts)]
+            elif path == "photo":
+                steps.append(("photo", None, rng.choice(photo_ids)))
+            else:
+                raise ValueError(f"Unknown path in --mix: {path}")
+        sessions.append((10_000 + user, steps))
+    return sessions
+
+
+def replay_sessions(path: str, telegram, photo_bytes: bytes) -> list:
+    """Recorded raw updates grouped by chat; photos are served as a generated image"""
+    from supervisor import shard_key
+    chats = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            message = update.get("message") or {}
+            if message.get("photo"):
+                for size in message["photo"]:
+                    telegram.files.setdefault(size["file_id"], photo_bytes)
+                kind = "photo"
+            elif (message.get("text") or "").startswith("/"):
+                kind = "command"
+            else:
+                kind = "text"
+            chats[shard_key(update)].append((kind, update))
+    return list(chats.items())
+
+
+# === Прогон ===
+async def _serve(app, port: int):
+    from aiohttp import web
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def run_e2e(args) -> dict:
+    from fake_telegram import FakeTelegram, make_photo_update, make_text_update
+    from fake_wiki import FakeWikipedia
+    import runner
+
+    photos = make_photos(args.photos)
+    telegram = FakeTelegram(files=photos, enforce_limits=args.send_limits)
+    wiki = FakeWikipedia(delay=args.wiki_delay_ms / 1000)
+    servers = [await _serve(telegram.app, args.telegram_port), await _serve(wiki.app, args.wiki_port)]
+
+    started = time.perf_counter()
+    app = importlib.import_module(args.app)
+    logging.getLogger().setLevel(args.log_level)
+    bot = runner.create_bot(app.API_TOKEN)
+    dp = app.create_dispatcher()
+    await app.startup()
+    await dp.emit_startup(bot=bot)
+    startup_s = time.perf_counter() - started
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    update_ids = itertools.count(1)
+    first_reply = []
+
+    async def feed(path: str, update: dict):
+        sent_at = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            errors[path] += 1
+            logging.debug(f"Update failed: {e}")
+        latencies[path].append(time.perf_counter() - sent_at)
+        if not first_reply:
+            first_reply.append(time.perf_counter() - started)
+
+    async def synthetic_user(chat_id: int, steps: list):
+        for path, text, file_id in steps:
+            update_id = next(update_ids)
+            if file_id is not None:
+                update = make_photo_update(update_id, chat_id, file_id, len(photos[file_id]))
+            else:
+                update = make_text_update(update_id, chat_id, text)
+            await feed(path, update)
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+
+    async def replayed_chat(updates: list):
+        for path, update in updates:
+            await feed(path, update)
+
+    if args.replay:
+        jobs = [replayed_chat(updates) for _, updates in replay_sessions(args.replay, telegram, next(iter(photos.values())))]
+    else:
+        jobs = [synthetic_user(chat_id, steps) for chat_id, steps in synthetic_sessions(args, list(photos))]
+
+    began = time.perf_counter()
+    await asyncio.gather(*jobs)
+    wall = time.perf_counter() - began
+
+    # Модели грузятся в фоне, поэтому их состояние снимаем до остановки
+    capabilities = sys.modules["readiness"].stats() if "readiness" in sys.modules else {}
+    await dp.emit_shutdown(bot=bot)
+    await app.shutdown()
+    await bot.session.close()
+    for server in servers:
+        await server.cleanup()
+
+    with sqlite3.connect(os.environ["ORDER_SQLITE_PATH"]) as cnx:
+        try:
+            orders_saved = cnx.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        except sqlite3.OperationalError:
+            orders_saved = 0   # таблица создаётся при первом сохранении
+    messages = sum(len(values) for values in latencies.values())
+    return {
+        "startup_s": round(startup_s, 3),
+        "first_reply_s": round(first_reply[0], 3) if first_reply else None,
+        "wall_s": round(wall, 3),
+        "messages": messages,
+        "throughput_msg_s": round(messages / wall, 2) if wall else 0.0,
+        "paths": {path: {**summarize(values, 1000, "ms"), "errors": errors[path]} for path, values in sorted(latencies.items())},
+        "orders_saved": orders_saved,
+        "replies": len(telegram.sent),
+        "telegram_429": telegram.rejected,
+        "wiki_requests": wiki.requests,
+        "capabilities": capabilities,
+    }
+
+
+# === Микробенчмарки ===
+def _bench(func, inputs: list, iterations: int) -> dict:
+    for value in inputs:
+        func(value)   # прогрев: ленивые загрузки и кэши не должны попадать в замер
+    samples = []
+    for index in range(iterations):
+        value = inputs[index % len(inputs)]
+        started = time.perf_counter()
+        func(value)
+        samples.append(time.perf_counter() - started)
+    result = summarize(samples, 1e6, "us")
+    result["ops_s"] = round(len(samples) / sum(samples), 1) if sum(samples) else 0.0
+    return result
+
+
+def run_micro(args) -> dict:
+    from nlp_pipeline import parse
+    from search import extract_keyphrase
+    from menu_index import get_menu_index
+    from main_bot import detect_pizza_intent
+    logging.getLogger().setLevel(args.log_level)
+
+    order_texts = [text for script in ORDER_SCRIPTS["main_bot"] for text in script]
+    docs = [parse(text) for text in TEXT_MESSAGES]
+    index = get_menu_index()
+    results = {
+        "nlp_parse": _bench(parse, TEXT_MESSAGES + order_texts, args.iterations),
+        "extract_keyphrase": _bench(extract_keyphrase, docs, args.iterations),
+        "detect_pizza_intent": _bench(detect_pizza_intent, TEXT_MESSAGES + order_texts, args.iterations),
+        "menu_match": _bench(index.best, MENU_QUERIES, args.iterations),
+    }
+    try:
+        from image import engine, load_image
+        images = [load_image(data) for data in make_photos(4).values()]
+        engine.load()
+        results["caption"] = _bench(engine.caption, images, args.caption_iterations)
+    except Exception as e:
+        results["caption"] = {"skipped": f"{type(e).__name__}: {e}"}
+    return results
+
+
+# === Команды ===
+def _report(result: dict, path: str = None):
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+def cmd_run(args):
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        configure_env(args, workdir)
+        result = {"meta": meta(args)}
+        result["e2e"] = asyncio.run(run_e2e(args))
+        if args.micro:
+            result["micro"] = run_micro(args)
+        result["peak_rss_mb"] = peak_rss_mb()
+    _report(result, args.json)
+
+
+def cmd_micro(args):
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        configure_env(args, workdir)
+        result = {"meta": meta(args), "micro": run_micro(args), "peak_rss_mb": peak_rss_mb()}
+    _report(result, args.json)
+
+
+def _change(old, new) -> str:
+    if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+        return ""
+    if not old:
+        return f"{old} -> {new}"
+    return f"{old} -> {new} ({(new - old) / old * 100:+.1f}%)"
+
+
+def cmd_compare(args):
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    old_e2e, new_e2e = old.get("e2e", {}), new.get("e2e", {})
+    for key in ("startup_s", "first_reply_s", "throughput_msg_s"):
+        if key in old_e2e and key in new_e2e:
+            print(f"e2e {key}: {_change(old_e2e[key], new_e2e[key])}")
+    for path in sorted(set(old_e2e.get("paths", {})) & set(new_e2e.get("paths", {}))):
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            print(f"e2e {path} {key}: {_change(old_e2e['paths'][path].get(key), new_e2e['paths'][path].get(key))}")
+    for name in sorted(set(old.get("micro", {})) & set(new.get("micro", {}))):
+        for key in ("p50_us", "p99_us"):
+            line = _change(old["micro"][name].get(key), new["micro"][name].get(key))
+            if line:
+                print(f"micro {name} {key}: {line}")
+    for key in ("self", "children"):
+        print(f"peak_rss_mb {key}: {_change(old.get('peak_rss_mb', {}).get(key), new.get('peak_rss_mb', {}).get(key))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def common(command):
+        command.add_argument("--app", default="main", help="module with create_dispatcher/startup/shutdown")
+        command.add_argument("--json", help="also write the report to this file")
+        command.add_argument("--iterations", type=int, default=2000, help="micro-benchmark calls per function")
+        command.add_argument("--caption-iterations", type=int, default=10)
+        command.add_argument("--telegram-port", type=int, default=18181)
+        command.add_argument("--wiki-port", type=int, default=18182)
+        command.add_argument("--send-limits", action="store_true", help="keep Telegram send limits (and enforce them in the fake API)")
+        command.add_argument("--log-level", default="WARNING")
+
+    run = commands.add_parser("run", help="end-to-end load test")
+    common(run)
+    run.add_argument("--users", type=int, default=20, help="concurrent chats")
+    run.add_argument("--actions", type=int, default=10, help="actions per chat (an order is several messages)")
+    run.add_argument("--mix", default=DEFAULT_MIX, help="weights of text/order/photo actions")
+    run.add_argument("--photos", type=int, default=8, help="distinct photos to draw from")
+    run.add_argument("--think-ms", type=float, default=0, help="pause between messages of one chat")
+    run.add_argument("--wiki-delay-ms", type=float, default=50, help="simulated Wikipedia response time")
+    run.add_argument("--replay", help="JSONL file of raw Telegram updates instead of the synthetic mix")
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--micro", action="store_true", help="also run the micro-benchmarks")
+    run.set_defaults(func=cmd_run)
+
+    micro = commands.add_parser("micro", help="micro-benchmarks only")
+    common(micro)
+    micro.set_defaults(func=cmd_micro)
+
+    compare = commands.add_parser("compare", help="compare two JSON reports")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,148 @@
+# cache.py
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size-bounded least-recently-used cache with hit/miss counters.
+    If `path` is given, entries can be saved to and restored from a JSON file
+    so the cache survives restarts (keys and values must be JSON-friendly).
+    """
+
+    def __init__(self, maxsize: int = 1024, path: str = None):
+        self.maxsize = max(1, maxsize)
+        self.path = path
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read cache file {self.path}: {e}")
+            return
+        for key, value in items[-self.maxsize:]:
+            self._data[key] = value
+
+    def save(self):
+        """Write entries (oldest first) to `path` atomically"""
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._data.items()), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries expire `ttl` seconds after they were stored.
+    A per-entry ttl can be passed to set(), e.g. to keep negative answers
+    for a shorter time than positive ones.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, clock=time.monotonic):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.clock = clock
+        self.expired = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            del self._data[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        super().set(key, (expires_at, value))
+
+    def stats(self) -> dict:
+        return {**super().stats(), "expired": self.expired}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    coroutine, everyone else arriving before it finishes awaits the same result.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """Run func() (a coroutine function) once per key among concurrent callers"""
+        self.calls += 1
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            task.exception()  # помечаем исключение как полученное
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._pending)}
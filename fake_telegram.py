@@ -0,0 +1,191 @@
+# fake_telegram.py
+"""
+Local stand-in for the Telegram Bot API, for running the bot without Telegram.
+
+    python fake_telegram.py [port]
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+
+The bot talks to it as to api.telegram.org. Fake updates are pushed with
+POST /_updates (a JSON list of updates, or {"chat_id": .., "text": ..}):
+they are posted to the webhook if one is set, otherwise served by getUpdates.
+GET /_sent returns everything the bot has sent. With enforce_limits=True
+(--limits on the command line) sends over the per-chat or global rate limits
+are answered with 429 and retry_after, as Telegram does.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import sys
+import time
+import aiohttp
+from aiohttp import web
+
+import send_limiter
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PizzaBot", "username": "pizza_bot"}
+
+
+def make_text_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def make_photo_update(update_id: int, chat_id: int, file_id: str, size: int = 0) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480, "file_size": size}],
+        },
+    }
+
+
+class FakeTelegram:
+    def __init__(self, files: dict = None, enforce_limits: bool = False):
+        self.files = dict(files or {})   # file_id -> bytes
+        self.enforce_limits = enforce_limits
+        self.global_bucket = send_limiter.TokenBucket(send_limiter.global_rate(), send_limiter.global_burst())
+        self.chat_buckets = {}
+        self.rejected = 0
+        self.sent = []
+        self.calls = {}
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.updates = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._session = None
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self._api)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+        self.app.router.add_post("/_updates", self._inject)
+        self.app.router.add_get("/_sent", self._sent)
+        self.app.on_cleanup.append(self._close)
+
+    def next_update_id(self) -> int:
+        return next(self._update_ids)
+
+    # === Bot API ===
+    async def _api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if not params and request.query:
+            params = dict(request.query)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.enforce_limits and method.startswith("send") and "chat_id" in params:
+            retry_after = self._over_limit(int(params["chat_id"]))
+            if retry_after:
+                self.rejected += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return await handler(params)
+
+    def _over_limit(self, chat_id: int) -> int:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = send_limiter.chat_bucket(chat_id)
+        wait = bucket.try_take() or self.global_bucket.try_take()
+        return max(1, math.ceil(wait)) if wait else 0
+
+    async def api_getMe(self, params):
+        return web.json_response({"ok": True, "result": BOT_USER})
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token") or None
+        logging.info(f"Webhook set to {self.webhook_url}")
+        return web.json_response({"ok": True, "result": True})
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = self.webhook_secret = None
+        return web.json_response({"ok": True, "result": True})
+
+    async def api_getUpdates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        offset = int(params.get("offset") or 0)
+        result = []
+        try:
+            result.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            pass
+        while not self.updates.empty():
+            result.append(self.updates.get_nowait())
+        return web.json_response({"ok": True, "result": [u for u in result if u["update_id"] >= offset]})
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        self.sent.append({"chat_id": chat_id, "text": message["text"], "at": time.time()})
+        return web.json_response({"ok": True, "result": message})
+
+    async def api_getFile(self, params):
+        file_id = params["file_id"]
+        if file_id not in self.files:
+            return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}, status=400)
+        return web.json_response({"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]), "file_path": f"photos/{file_id}.jpg",
+        }})
+
+    async def _file(self, request: web.Request) -> web.Response:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.files[file_id], content_type="image/jpeg")
+
+    # === Поставка апдейтов ===
+    async def push(self, update: dict):
+        """Deliver an update to the webhook, or queue it for getUpdates"""
+        if self.webhook_url is None:
+            await self.updates.put(update)
+            return
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+        async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+            if response.status != 200:
+                logging.warning(f"Webhook returned {response.status} for update {update['update_id']}")
+
+    async def _inject(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if isinstance(body, dict):
+            body = [make_text_update(self.next_update_id(), int(body["chat_id"]), body["text"])]
+        await asyncio.gather(*(self.push(update) for update in body))
+        return web.json_response({"ok": True, "pushed": len(body)})
+
+    async def _sent(self, request: web.Request) -> web.Response:
+        return web.json_response(self.sent)
+
+    async def _close(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if arg != "--limits"]
+    port = int(args[0]) if args else 8081
+    web.run_app(FakeTelegram(enforce_limits="--limits" in sys.argv).app, host="127.0.0.1", port=port)
@@ -0,0 +1,52 @@
+# fake_wiki.py
+"""
+Local stand-in for the MediaWiki API used by wiki.py (search, extracts,
+disambiguation links), with a configurable response delay.
+
+    python fake_wiki.py [port] [delay_ms]
+    WIKI_API_URL=http://127.0.0.1:8765/w/api.php python main.py
+"""
+import asyncio
+import sys
+from aiohttp import web
+
+# Запросы, на которые «Википедия» ничего не находит или отвечает страницей неоднозначности
+NOT_FOUND = {"zzz", "asdfgh", "qwerty"}
+DISAMBIGUATION = {"mercury", "java", "python"}
+
+
+class FakeWikipedia:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/w/api.php", self._api)
+
+    async def _api(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        query = request.query
+        if query.get("list") == "search":
+            term = query.get("srsearch", "").strip().lower()
+            hits = [] if not term or term in NOT_FOUND else [{"title": term.title()}]
+            return web.json_response({"query": {"searchinfo": {}, "search": hits}})
+        if query.get("action") == "parse":
+            # Значения в порядке страницы, а не по алфавиту; оглавление и «См. также» как на настоящей
+            page = query.get("page", "")
+            return web.json_response({"parse": {"title": page, "text": (
+                f'<div class="mw-parser-output"><p><b>{page}</b> may refer to:</p>'
+                f'<div id="toc"><ul><li class="toclevel-1 tocsection-1"><a href="#Science">Science</a></li></ul></div>'
+                f'<ul><li><a href="/wiki/{page}_(planet)" title="{page} (planet)">{page} (planet)</a>, a planet</li>'
+                f'<li><a href="/wiki/{page}_(element)" title="{page} (element)">{page} (element)</a></li></ul>'
+                f'<h2>See also</h2><ul><li><a href="/wiki/All_pages" title="All pages">All pages</a></li></ul></div>')}})
+        title = query.get("titles", "")
+        if title.lower() in DISAMBIGUATION:
+            return web.json_response({"query": {"pages": [{"title": title, "pageprops": {"disambiguation": ""}, "extract": ""}]}})
+        return web.json_response({"query": {"pages": [{"title": title, "extract": f"{title} is a well-known topic."}]}})
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    web.run_app(FakeWikipedia(delay).app, host="127.0.0.1", port=port)
@@ -0,0 +1,180 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey, DEFAULT_DESTINY
+from aiogram.fsm.storage.memory import MemoryStorage
+from dotenv import load_dotenv
+
+load_dotenv()
+# sqlite — состояния на диске (переживают рестарт), memory — как раньше, в словаре
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_DB_PATH = os.getenv('FSM_DB_PATH', 'fsm.db')
+FSM_HOT_SIZE = int(os.getenv('FSM_HOT_SIZE', '2048'))
+# Брошенные на середине заказы удаляются через сутки
+FSM_IDLE_TTL = float(os.getenv('FSM_IDLE_TTL', '86400'))
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', '600'))
+
+
+def _encode_key(key: StorageKey) -> str:
+    # Компактный ключ: необязательные поля пишем только если они заданы
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id is not None or key.business_connection_id or key.destiny != DEFAULT_DESTINY:
+        parts += [str(key.thread_id or ""), key.business_connection_id or "", key.destiny]
+    return ":".join(parts)
+
+
+def _encode_data(data: Mapping[str, Any]):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage backed by an embedded SQLite file (WAL) with a small LRU hot tier.
+    Each chat is one row: state name plus data as compact JSON. Rows with no
+    state and no data are deleted, and sessions idle for longer than `ttl`
+    are evicted by a periodic sweep, so memory and disk stay bounded.
+    """
+
+    def __init__(self, path: str = FSM_DB_PATH, hot_size: int = FSM_HOT_SIZE,
+                 ttl: float = FSM_IDLE_TTL, sweep_interval: float = FSM_SWEEP_INTERVAL):
+        self.path = path
+        self.hot_size = max(1, hot_size)
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._cnx = sqlite3.connect(path, isolation_level=None)
+        self._cnx.execute("PRAGMA journal_mode=WAL")
+        self._cnx.execute("PRAGMA synchronous=NORMAL")
+        self._cnx.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT,"
+            " touched REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._cnx.execute("CREATE INDEX IF NOT EXISTS fsm_touched ON fsm (touched)")
+        # key -> [state, data (dict), touched]
+        self._hot = OrderedDict()
+        self._sweeper = None
+        self.hot_hits = 0
+        self.cold_loads = 0
+        self.evicted = 0
+
+    # === Горячий слой ===
+    def _record(self, key: str) -> list:
+        record = self._hot.get(key)
+        if record is not None:
+            self._hot.move_to_end(key)
+            self.hot_hits += 1
+        else:
+            self.cold_loads += 1
+            row = self._cnx.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+            state, data = row if row else (None, None)
+            record = [state, json.loads(data) if data else {}, 0.0]
+            self._remember(key, record)
+        record[2] = time.time()
+        self._ensure_sweeper()
+        return record
+
+    def _remember(self, key: str, record: list):
+        self._hot[key] = record
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_size:
+            old_key, old_record = self._hot.popitem(last=False)
+            self._touch(old_key, old_record)
+
+    def _touch(self, key: str, record: list):
+        # Время последнего обращения попадает на диск, когда запись уходит из памяти
+        self._cnx.execute("UPDATE fsm SET touched = ? WHERE key = ?", (record[2], key))
+
+    def _write(self, key: str, record: list):
+        state, data, touched = record
+        if state is None and not data:
+            self._cnx.execute("DELETE FROM fsm WHERE key = ?", (key,))
+            self._hot.pop(key, None)
+            return
+        self._cnx.execute(
+            "INSERT INTO fsm (key, state, data, touched) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, touched = excluded.touched",
+            (key, state, _encode_data(data), touched),
+        )
+
+    # === BaseStorage ===
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        encoded = _encode_key(key)
+        record = self._record(encoded)
+        record[0] = state.state if isinstance(state, State) else state
+        self._write(encoded, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return self._record(_encode_key(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        encoded = _encode_key(key)
+        record = self._record(encoded)
+        record[1] = dict(data)
+        self._write(encoded, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict(self._record(_encode_key(key))[1])
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for key, record in self._hot.items():
+            self._touch(key, record)
+        self._hot.clear()
+        logging.info(f"FSM storage: {self.stats()}")
+        self._cnx.close()
+
+    # === Очистка неактивных сессий ===
+    def _ensure_sweeper(self):
+        if self._sweeper is None and self.ttl > 0:
+            try:
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+            except RuntimeError:
+                pass
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"FSM sweep failed: {e}")
+
+    def sweep(self, now: float = None) -> int:
+        """Drop sessions idle for longer than ttl; returns how many were removed"""
+        cutoff = (now or time.time()) - self.ttl
+        for key in [key for key, record in self._hot.items() if record[2] < cutoff]:
+            del self._hot[key]
+        self._cnx.execute("BEGIN")
+        self._cnx.executemany("UPDATE fsm SET touched = ? WHERE key = ?",
+                              [(record[2], key) for key, record in self._hot.items()])
+        removed = self._cnx.execute("DELETE FROM fsm WHERE touched < ?", (cutoff,)).rowcount
+        self._cnx.execute("COMMIT")
+        self.evicted += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "hot": len(self._hot),
+            "hot_hits": self.hot_hits,
+            "cold_loads": self.cold_loads,
+            "evicted": self.evicted,
+        }
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown FSM storage: {kind}")
@@ -1,35 +1,298 @@
 # image.py
+import asyncio
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import torch
 from PIL import Image
 from transformers import BlipProcessor, BlipForConditionalGeneration
+from dotenv import load_dotenv
 import os
 
-def get_photo_tags(image_path: str) -> str:
+from batching import MicroBatcher
+import metrics
+from cache import LRUCache, SingleFlight
+
+load_dotenv()
+MODEL_NAME = "Salesforce/blip-image-captioning-base"
+CAPTION_BATCH_SIZE = int(os.getenv('CAPTION_BATCH_SIZE', '8'))
+CAPTION_MAX_WAIT_MS = float(os.getenv('CAPTION_MAX_WAIT_MS', '50'))
+# 0 — считать в потоке внутри процесса бота, N — пул из N процессов
+CAPTION_WORKERS = int(os.getenv('CAPTION_WORKERS', '1'))
+CAPTION_TORCH_THREADS = int(os.getenv('CAPTION_TORCH_THREADS', '0'))
+CAPTION_TIMEOUT = float(os.getenv('CAPTION_TIMEOUT', '60'))
+CAPTION_CACHE_SIZE = int(os.getenv('CAPTION_CACHE_SIZE', '10000'))
+CAPTION_CACHE_PATH = os.getenv('CAPTION_CACHE_PATH') or None
+
+
+class CaptionEngine:
+    """
+    Long-lived BLIP captioning engine.
+    The processor and model are loaded once and reused for every photo.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model_name = model_name
+        self.processor = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self):
+        """Load the processor and model (no-op if already loaded)"""
+        with self._lock:
+            if self.model is not None:
+                return
+            logging.info(f"Loading captioning model {self.model_name}")
+            self.processor = BlipProcessor.from_pretrained(self.model_name)
+            model = BlipForConditionalGeneration.from_pretrained(self.model_name)
+            model.eval()
+            self.model = model
+
+    def close(self):
+        """Release the model so its memory can be reclaimed"""
+        with self._lock:
+            self.processor = None
+            self.model = None
+
+    def caption(self, raw_image: Image.Image) -> str:
+        return self.caption_batch([raw_image])[0]
+
+    def caption_batch(self, raw_images: list) -> list:
+        """Caption several images with a single padded generate call"""
+        self.load()
+        inputs = self.processor(images=raw_images, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            out = self.model.generate(**inputs, max_new_tokens=50)
+        return self.processor.batch_decode(out, skip_special_tokens=True)
+
+
+# Один экземпляр на процесс
+engine = CaptionEngine()
+
+
+def load_image(source) -> Image.Image:
+    """Decode a path, raw bytes or an already opened PIL image into RGB"""
+    if isinstance(source, Image.Image):
+        return source.convert('RGB')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source)).convert('RGB')
+    if isinstance(source, io.IOBase):
+        return Image.open(source).convert('RGB')
+    return Image.open(source).convert('RGB')
+
+
+def image_hash(source) -> str:
+    """64-bit difference hash: survives re-encoding and resizing of the same picture"""
+    gray = load_image(source).convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def _caption_sources(sources: list) -> list:
+    """Decode images and caption the readable ones as one batch"""
+    results = ["object"] * len(sources)
+    images, positions = [], []
+    for i, source in enumerate(sources):
+        if isinstance(source, str) and not os.path.exists(source):
+            results[i] = "image file does not exist"
+            continue
+        try:
+            images.append(load_image(source))
+            positions.append(i)
+        except Exception as e:
+            logging.error(f"Error decoding image: {e}")
+    if images:
+        for i, caption in zip(positions, engine.caption_batch(images)):
+            results[i] = caption
+    return results
+
+
+# === Пул процессов: у каждого воркера своя копия модели ===
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(torch_threads: int):
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    engine.load()
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: воркеры не наследуют потоки torch из родителя. __main__ они всё равно
+            # импортируют заново (как spawn), поэтому в main ничего тяжёлого при импорте не делаем
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["image"])
+            _pool = ProcessPoolExecutor(
+                max_workers=CAPTION_WORKERS,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(CAPTION_TORCH_THREADS,),
+            )
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool (a worker was killed, e.g. by OOM, or failed to load); the next batch starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_captioning():
+    """Start the worker pool (or load the in-process model) and warm it up"""
+    if CAPTION_WORKERS <= 0:
+        if CAPTION_TORCH_THREADS > 0:
+            torch.set_num_threads(CAPTION_TORCH_THREADS)
+        engine.load()
+        return
+    pool = _get_pool()
+    # Каждый воркер загружает модель в initializer; дожидаемся всех
+    try:
+        pids = {f.result() for f in [pool.submit(_worker_ready) for _ in range(CAPTION_WORKERS)]}
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    logging.info(f"Captioning workers ready: {sorted(pids)}")
+
+
+def stop_captioning():
+    global _pool
+    logging.info(f"Caption cache: {caption_cache.stats()}, coalescing: {caption_flight.stats()}")
+    try:
+        caption_cache.save()
+    except OSError as e:
+        logging.error(f"Could not save caption cache: {e}")
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    engine.close()
+
+
+async def _run_caption_batch(sources: list) -> list:
+    if CAPTION_WORKERS <= 0:
+        return await asyncio.to_thread(_caption_sources, sources)
+    pool = _get_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, _caption_sources, sources)
+    except BrokenProcessPool:
+        # Мёртвый пул отказывает во всех следующих задачах — заменяем его, этот батч не повторяем
+        logging.error("Captioning worker died, restarting the pool")
+        _discard_pool(pool)
+        raise
+
+
+# Очередь: фото, пришедшие почти одновременно, идут в модель одним батчем
+caption_queue = MicroBatcher(
+    _run_caption_batch,
+    max_batch_size=CAPTION_BATCH_SIZE,
+    max_wait=CAPTION_MAX_WAIT_MS / 1000,
+    concurrency=max(1, CAPTION_WORKERS),
+    name="caption",
+)
+
+
+@metrics.timed("get_photo_tags")
+async def caption_image(image, timeout: float = CAPTION_TIMEOUT) -> str:
+    """
+    Async counterpart of get_photo_tags that goes through the batching queue.
+    Accepts a path, raw bytes or a PIL image. If the caller is cancelled or the timeout expires while the photo is still
+    queued, it is dropped from the batch.
+    """
+    try:
+        return await asyncio.wait_for(caption_queue.submit(image), timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Captioning timed out after {timeout}s")
+        return "object"
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Error processing image with VLM: {e}")
+        return "object"
+
+
+# Кэш подписей: по file_unique_id (до скачивания) и по хэшу картинки (после)
+caption_cache = LRUCache(maxsize=CAPTION_CACHE_SIZE, path=CAPTION_CACHE_PATH)
+caption_flight = SingleFlight()
+metrics.register_cache("caption", caption_cache)
+
+
+async def caption_photo(bot, photo) -> str:
+    """
+    Caption a Telegram PhotoSize. Repeated photos are answered from the cache:
+    a known file_unique_id skips the download, a known image hash skips the model.
+    The same photo sent by several chats at once is downloaded and captioned once.
+    """
+    file_key = f"file:{photo.file_unique_id}"
+    tag = caption_cache.get(file_key)
+    if tag is not None:
+        return tag
+    return await caption_flight.do(file_key, lambda: _download_and_caption(bot, photo, file_key))
+
+
+async def _download_and_caption(bot, photo, file_key: str) -> str:
+    with metrics.timer("photo_download"):
+        file = await bot.get_file(photo.file_id)
+        # Скачиваем прямо в память, без временных файлов
+        buffer = io.BytesIO()
+        await bot.download_file(file.file_path, destination=buffer)
+    data = buffer.getvalue()
+
+    hash_key = f"phash:{await asyncio.to_thread(image_hash, data)}"
+    tag = caption_cache.get(hash_key)
+    if tag is None:
+        tag = await caption_image(data)
+        if tag == "object":
+            # Запасной ответ после ошибки не кэшируем
+            return tag
+        caption_cache.set(hash_key, tag)
+    caption_cache.set(file_key, tag)
+    return tag
+
+
+@metrics.timed("get_photo_tags")
+def get_photo_tags(image) -> str:
     """
     Image classification function using a pre-trained VLM (Vision-Language Model).
     Uses BLIP model for image understanding and description.
+    `image` may be a file path, raw bytes or a PIL image.
     """
     try:
         # Check if image file exists
-        if not os.path.exists(image_path):
+        if isinstance(image, str) and not os.path.exists(image):
             return "image file does not exist"
-        
-        # Load a pre-trained BLIP model and processor
-        # Using BLIP for image-to-text generation
-        processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-        
+
         # Load and process the image
-        raw_image = Image.open(image_path).convert('RGB')
-        
-        # Generate image caption
-        inputs = processor(raw_image, return_tensors="pt")
-        out = model.generate(**inputs, max_new_tokens=50)
-        caption = processor.decode(out[0], skip_special_tokens=True)
-        
-        return caption
-            
+        raw_image = load_image(image)
+
+        # Generate image caption with the resident model
+        return engine.caption(raw_image)
+
     except Exception as e:
         print(f"Error processing image with VLM: {str(e)}")
         # Fallback to a simple description
-        return "object"
\ No newline at end of file
+        return "object"
@@ -6,12 +6,20 @@ from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
 from pizza_bot import router as pizza_router
-from search import extract_keyphrase, search_wikipedia, nlp
-from image import get_photo_tags
+from search import extract_keyphrase, search_wikipedia
+from nlp_pipeline import parse_async
+import order_store
+from fsm_storage import create_fsm_storage
+from order_journal import journal as order_journal
+import metrics
+import readiness
+from runner import create_bot, run_bot
+from scheduler import scheduler
+from send_limiter import send_limiter
+from wiki import close_session
 
 load_dotenv()
 API_TOKEN = os.getenv('BOT_API_KEY')
@@ -47,9 +55,10 @@ async def handle_text(message: Message, state: FSMContext):
 
     # Универсальный режим
     try:
-        doc = nlp(message.text)
+        await readiness.wait("nlp")
+        doc = await parse_async(message.text)
         phrase = extract_keyphrase(doc).strip()
-        answer = search_wikipedia(phrase) if phrase else "I didn't get that."
+        answer = await search_wikipedia(phrase) if phrase else "I didn't get that."
         await message.answer(answer)
     except Exception as e:
         logging.error(f"Text error: {e}")
@@ -64,26 +73,57 @@ async def handle_photo(message: Message, bot: Bot, state: FSMContext):
 
     try:
         photo = message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        os.makedirs("temp", exist_ok=True)
-        path = f"temp/{photo.file_id}.jpg"
-        await bot.download_file(file.file_path, path)
-        tag = get_photo_tags(path)
-        desc = search_wikipedia(tag)
+        # Фото, пришедшее во время прогрева, ждёт ту же загрузку BLIP, а не запускает вторую
+        await readiness.wait("caption")
+        from image import caption_photo
+        tag = await caption_photo(bot, photo)
+        desc = await search_wikipedia(tag)
         await message.answer(f"🖼️ This looks like: *{tag}*\n\n{desc}", parse_mode="Markdown")
-        os.remove(path)
     except Exception as e:
         logging.error(f"Photo error: {e}")
         await message.answer("Sorry, I couldn't analyze this image.")
 
 # === Запуск ===
-async def main():
-    bot = Bot(token=API_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher() -> Dispatcher:
+    # Состояния заказа хранятся на диске и переживают перезапуск
+    dp = Dispatcher(storage=create_fsm_storage())
+    # Ограничиваем работу в полёте: шаги заказа впереди Википедии, Википедия впереди фото
+    dp.message.outer_middleware(scheduler)
+    # Имя хендлера для меток метрик и время самого хендлера
+    dp.message.middleware(metrics.HandlerMiddleware())
     dp.include_router(pizza_router)  # pizza FSM
     dp.include_router(main_router)   # universal fallback
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    return dp
+
+
+async def startup():
+    await metrics.start_metrics_server()
+    # Дописываем в БД заказы, не сброшенные до прошлой остановки
+    await order_journal.start()
+    # Модели грузятся в фоне: апдейты принимаются сразу, обработчик ждёт только то, что ему нужно
+    readiness.warm_up()
+
+
+async def shutdown():
+    logging.info(f"Scheduler: {scheduler.stats()}")
+    logging.info(f"Send limiter: {send_limiter.stats()}")
+    logging.info(f"Capabilities: {readiness.stats()}")
+    await readiness.close_all()
+    await order_journal.stop()
+    order_store.close()
+    await close_session()
+    await metrics.stop_metrics_server()
+
+
+async def main():
+    bot = create_bot(API_TOKEN)
+    dp = create_dispatcher()
+    await startup()
+    try:
+        # BOT_MODE=polling (по умолчанию) или webhook
+        await run_bot(dp, bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -2,66 +2,34 @@
 import asyncio
 import logging
 import os
+from functools import cached_property
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-import spacy
-import wikipedia
 from dotenv import load_dotenv
 
+from menu_index import get_menu_index
+from nlp_pipeline import get_nlp, parse, parse_async, tokenize
+from search import extract_keyphrase
+import order_store
+from fsm_storage import create_fsm_storage
+from order_journal import journal as order_journal
+import metrics
+import readiness
+from runner import create_bot, run_bot
+from scheduler import scheduler
+from send_limiter import send_limiter
+from wiki import search_wikipedia, close_session
+
 
 
 load_dotenv()
 API_TOKEN = os.getenv('BOT_API_KEY')
 
 logging.basicConfig(level=logging.INFO)
-nlp = spacy.load("en_core_web_sm")
-wikipedia.set_lang("en")
 main_router = Router()
 
-# === Универсальные функции (без изменений) ===
-def extract_keyphrase(doc):
-    for token in doc:
-        if token.dep_ == "pobj":
-            tokens = [left for left in token.lefts if left.dep_ in ("amod", "compound")]
-            tokens.append(token)
-            for child in token.rights:
-                if child.dep_ == "prep":
-                    tokens.append(child)
-                    for gc in child.children:
-                        if gc.dep_ == "pobj":
-                            tokens.extend([gcl for gcl in gc.lefts if gcl.dep_ in ("amod", "compound")] + [gc])
-            if tokens:
-                return " ".join(t.text for t in sorted(tokens, key=lambda x: x.i))
-    verbs = [t for t in reversed(doc) if t.pos_ == "VERB"]
-    for verb in verbs:
-        subj = next((c for c in verb.children if c.dep_ == "nsubj"), None)
-        if subj:
-            subj_part = [left for left in subj.lefts if left.dep_ in ("amod", "compound")]
-            subj_part.append(subj)
-            phrase = " ".join(t.text for t in sorted(subj_part, key=lambda x: x.i)) + " " + verb.lemma_
-            dobj = next((c for c in verb.children if c.dep_ == "dobj"), None)
-            if dobj:
-                dobj_part = [left for left in dobj.lefts if left.dep_ in ("amod", "compound")]
-                dobj_part.append(dobj)
-                phrase += " " + " ".join(t.text for t in sorted(dobj_part, key=lambda x: x.i))
-            return phrase.strip()
-    return " ".join(t.text for t in doc if t.pos_ in ("NOUN", "PROPN", "VERB")) or str(doc)
-
-def search_wikipedia(query: str) -> str:
-    try:
-        return wikipedia.summary(query, sentences=1)
-    except wikipedia.exceptions.DisambiguationError as e:
-        return wikipedia.summary(e.options[0], sentences=1) if e.options else f"Too many meanings for '{query}'."
-    except wikipedia.exceptions.PageError:
-        return f"Nothing found about '{query}' in Wikipedia."
-    except Exception:
-        return "Sorry, Wikipedia search failed."
-
-
-
 # === Хендлеры ===
 
 @main_router.message(Command("start"))
@@ -76,45 +44,127 @@ async def universal_start(message: Message, state: FSMContext):
         "Just start!"
     )
 
-def detect_pizza_intent(text: str) -> bool:
+class MessageAnalysis:
+    """
+    One incoming message, parsed once. Every analyzer below reads the same Doc;
+    intent, quantity, pizza type and keyphrase are computed on first access.
+    """
+
+    def __init__(self, text: str, doc=None):
+        self.text = text
+        if doc is not None:
+            self.doc = doc
+
+    @cached_property
+    def doc(self):
+        return parse(self.text)
+
+    async def ensure_parsed(self):
+        """Parse through the batched NLP service unless a Doc is already attached"""
+        if "doc" not in self.__dict__:
+            self.doc = await parse_async(self.text)
+        return self.doc
+
+    @cached_property
+    def pizza_candidate(self) -> bool:
+        return is_pizza_candidate(self.text)
+
+    @cached_property
+    def lower_text(self) -> str:
+        return self.text.lower()
+
+    @cached_property
+    def pizza_intent(self) -> bool:
+        return detect_pizza_intent(self)
+
+    @cached_property
+    def pizza_info(self):
+        return extract_pizza_info(self)
+
+    @property
+    def quantity(self) -> int:
+        return self.pizza_info[0]
+
+    @property
+    def pizza_type(self):
+        return self.pizza_info[1]
+
+    @cached_property
+    def keyphrase(self) -> str:
+        return extract_keyphrase(self.doc).strip()
+
+
+PIZZA_INTENTS = [
+    "i want a pizza",
+    "i want some pizza",
+    "i would like a pizza",
+    "i need a pizza",
+    "i'd like a pizza",
+    "i want pizza",
+    "i would like pizza",
+    "i need pizza",
+    "i'd like pizza",
+    "can i get a pizza",
+    "can i have a pizza",
+    "order pizza",
+    "get pizza"
+]
+
+# === Быстрый фильтр: без "pizza" в тексте намерения заказать пиццу нет ===
+PIZZA_WORDS = ["pizza", "pizzas"]
+_pizza_matcher = None
+
+
+def _get_pizza_matcher():
+    global _pizza_matcher
+    if _pizza_matcher is None:
+        from spacy.matcher import PhraseMatcher
+        matcher = PhraseMatcher(get_nlp().vocab, attr="LOWER")
+        matcher.add("PIZZA", [tokenize(word) for word in PIZZA_WORDS])
+        _pizza_matcher = matcher
+    return _pizza_matcher
+
+
+def is_pizza_candidate(text: str) -> bool:
+    """Tokenizer-only check; messages that fail it never reach the tagger/parser"""
+    lower_text = text.lower()
+    # Дешёвая проверка подстроки, затем совпадение по токенам
+    if "pizza" not in lower_text:
+        return False
+    return bool(_get_pizza_matcher()(tokenize(text))) or any(intent in lower_text for intent in PIZZA_INTENTS)
+
+
+def analyze(message) -> MessageAnalysis:
+    """Accept either raw text or an existing analysis"""
+    return message if isinstance(message, MessageAnalysis) else MessageAnalysis(message)
+
+
+def detect_pizza_intent(message) -> bool:
     """Detect if the user wants to order pizza using spaCy"""
-    doc = nlp(text.lower())
+    analysis = analyze(message)
+    if not analysis.pizza_candidate:
+        return False
+    doc = analysis.doc
     
     # Check for variations of "i want a pizza" and similar phrases
     for token in doc:
-        if token.lemma_ in ["want", "would", "like", "need", "order", "get"]:
+        if token.lemma_.lower() in ["want", "would", "like", "need", "order", "get"]:
             # Look for pizza in the sentence
             for child in token.subtree:
-                if child.lemma_ in ["pizza", "pizzas"]:
+                if child.lemma_.lower() in ["pizza", "pizzas"]:
                     return True
     
     # Check for common phrases indicating pizza intent
-    lower_text = text.lower()
-    pizza_intents = [
-        "i want a pizza",
-        "i want some pizza",
-        "i would like a pizza",
-        "i need a pizza",
-        "i'd like a pizza",
-        "i want pizza",
-        "i would like pizza",
-        "i need pizza",
-        "i'd like pizza",
-        "can i get a pizza",
-        "can i have a pizza",
-        "order pizza",
-        "get pizza"
-    ]
-    
-    for intent in pizza_intents:
+    lower_text = analysis.lower_text
+    for intent in PIZZA_INTENTS:
         if intent in lower_text:
             return True
             
     return False
 
-def extract_pizza_info(text: str):
+def extract_pizza_info(message):
     """Extract pizza type and quantity from text using spaCy"""
-    doc = nlp(text.lower())
+    doc = analyze(message).doc
     
     # Extract quantity
     quantity = 1  # default
@@ -126,29 +176,30 @@ def extract_pizza_info(text: str):
     
     # Look for numbers and number words
     for token in doc:
-        if token.text in word_to_num:
-            quantity = word_to_num[token.text]
+        lemma = token.lemma_.lower()
+        if token.lower_ in word_to_num:
+            quantity = word_to_num[token.lower_]
         elif token.text.isdigit():
             quantity = int(token.text)
-        elif token.lemma_ in ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]:
-            quantity = word_to_num[token.lemma_]
+        elif lemma in ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]:
+            quantity = word_to_num[lemma]
     
     # Extract pizza type by looking for adjectives or nouns before/around "pizza"
     pizza_type = None
     for token in doc:
-        if token.lemma_ == "pizza":
+        if token.lemma_.lower() == "pizza":
             # Look for modifiers (adjectives, compounds) before the pizza token
             modifiers = []
             for left in token.lefts:
                 if left.dep_ in ("amod", "compound", "det"):
-                    modifiers.append(left.text)
+                    modifiers.append(left.lower_)
             
             # If no modifiers found, check if there are other nouns nearby that might be pizza types
             if not modifiers:
                 # Look at tokens within a certain distance
                 for i, t in enumerate(doc):
                     if t != token and t.pos_ in ("NOUN", "ADJ") and abs(t.i - token.i) <= 2:
-                        modifiers.append(t.text)
+                        modifiers.append(t.lower_)
             
             if modifiers:
                 pizza_type = " ".join(modifiers).title()
@@ -157,9 +208,10 @@ def extract_pizza_info(text: str):
             break
     
     # If we didn't find a specific type but there are adjectives that could be pizza types
+    # (Doc разобран в исходном регистре, поэтому "Pepperoni" может оказаться PROPN)
     if not pizza_type:
         for token in doc:
-            if token.pos_ == "ADJ" and token.lemma_ in ["pepperoni", "margherita", "vegetarian", 
+            if token.pos_ in ("ADJ", "PROPN") and token.lemma_.lower() in ["pepperoni", "margherita", "vegetarian", 
                                                         "hawaiian", "meat", "bbq", "chicken", 
                                                         "supreme", "cheese", "four"]:
                 pizza_type = token.text.title()
@@ -168,52 +220,42 @@ def extract_pizza_info(text: str):
     return quantity, pizza_type
 
 def check_pizza_in_menu(pizza_type: str) -> bool:
-    """Check if the pizza type exists in the menu using spaCy similarity"""
-    # Import the menu from pizza.py
-    from pizza import MENU
-    import spacy
-    
-    nlp = spacy.load("en_core_web_sm")
-    
-    # Create spaCy doc for the pizza type
-    user_doc = nlp(pizza_type.lower())
-    
-    # Compare with each menu item
-    for pizza in MENU:
-        menu_doc = nlp(pizza['name'].lower())
-        
-        # Calculate similarity using spaCy's built-in similarity function
-        try:
-            similarity = user_doc.similarity(menu_doc)
-        except:
-            # Fallback if similarity calculation fails
-            similarity = 0.0
-        
-        # Return True if similarity is above threshold
-        if similarity >= 0.88:
-            return True
-    return False
+    """Check if the pizza type exists in the menu (precomputed menu index)"""
+    return get_menu_index().best(pizza_type) is not None
 
 @main_router.message(F.text)
 async def handle_text(message: Message, state: FSMContext):
     # Check if the user wants to order pizza
-    if detect_pizza_intent(message.text):
-        quantity, pizza_type = extract_pizza_info(message.text)
+    # Сообщение разбирается один раз, все анализаторы работают с общим Doc
+    try:
+        await readiness.wait("nlp")
+        analysis = MessageAnalysis(message.text)
+        if analysis.pizza_candidate:
+            await analysis.ensure_parsed()
+        pizza_intent = detect_pizza_intent(analysis)
+        if pizza_intent:
+            await readiness.wait("menu")
+    except Exception as e:
+        # Модель не загрузилась: отвечаем, а не молчим; следующая попытка повторит загрузку
+        logging.error(f"Text error: {e}")
+        await message.answer("I couldn't understand. Try rephrasing.")
+        return
+    if pizza_intent:
+        quantity, pizza_type = extract_pizza_info(analysis)
         
         # Check if we have enough information to place an order
-        if pizza_type and check_pizza_in_menu(pizza_type):
+        # (в заказ идёт название из меню, а не написанное пользователем: "A Peperoni" -> "Pepperoni")
+        menu_name = get_menu_index().best(pizza_type) if pizza_type else None
+        if menu_name:
             # We have a valid pizza type from the menu, so place the order directly
-            from pizza import save_order_to_db
+            from order_journal import journal
+            from order_store import Order
             
-            orderdict = {
-                "product": "pizza",
-                "ptype": pizza_type,
-                "qty": quantity
-            }
+            order = Order(product="pizza", ptype=menu_name, qty=quantity)
             
             try:
-                save_order_to_db(orderdict)
-                summary = "\n".join(f"{k} - {v}" for k, v in orderdict.items())
+                await journal.append(order)
+                summary = "\n".join(f"{k} - {v}" for k, v in order.as_dict().items())
                 await message.answer(f"✅ Your pizza order has been placed:\n{summary}\nThank you! 🍕")
             except Exception as e:
                 logging.error(f"Order error: {e}")
@@ -235,16 +277,16 @@ async def handle_text(message: Message, state: FSMContext):
 
     # Универсальный режим
     try:
-        doc = nlp(message.text)
-        phrase = extract_keyphrase(doc).strip()
-        answer = search_wikipedia(phrase) if phrase else "I didn't get that."
+        await analysis.ensure_parsed()
+        phrase = analysis.keyphrase
+        answer = await search_wikipedia(phrase) if phrase else "I didn't get that."
         await message.answer(answer)
     except Exception as e:
         logging.error(f"Text error: {e}")
         await message.answer("I couldn't understand. Try rephrasing.")
 
 @main_router.message(F.photo)
-async def handle_photo(message: Message, bot: Bot):
+async def handle_photo(message: Message, bot: Bot, state: FSMContext):
     current_state = await state.get_state()
     if current_state and "PizzaOrder" in current_state:
         await message.answer("Please finish your pizza order first before sending photos.")
@@ -252,28 +294,57 @@ async def handle_photo(message: Message, bot: Bot):
 
     try:
         photo = message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        os.makedirs("temp", exist_ok=True)
-        path = f"temp/{photo.file_id}.jpg"
-        await bot.download_file(file.file_path, path)
         
-        # Use the image module for tag extraction
-        from image import get_photo_tags
-        tag = get_photo_tags(path)
-        desc = search_wikipedia(tag)
+        # Фото, пришедшее во время прогрева, ждёт ту же загрузку BLIP, а не запускает вторую
+        await readiness.wait("caption")
+        from image import caption_photo
+        tag = await caption_photo(bot, photo)
+        desc = await search_wikipedia(tag)
         await message.answer(f"🖼️ This looks like: *{tag}*\n\n{desc}", parse_mode="Markdown")
-        os.remove(path)
     except Exception as e:
         logging.error(f"Photo error: {e}")
         await message.answer("Sorry, I couldn't analyze this image.")
 
 # === Запуск ===
-async def main():
-    bot = Bot(token=API_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher() -> Dispatcher:
+    # Состояния заказа хранятся на диске и переживают перезапуск
+    dp = Dispatcher(storage=create_fsm_storage())
+    # Ограничиваем работу в полёте: шаги заказа впереди Википедии, Википедия впереди фото
+    dp.message.outer_middleware(scheduler)
+    # Имя хендлера для меток метрик и время самого хендлера
+    dp.message.middleware(metrics.HandlerMiddleware())
     dp.include_router(main_router)   # universal fallback
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    return dp
+
+
+async def startup():
+    await metrics.start_metrics_server()
+    # Дописываем в БД заказы, не сброшенные до прошлой остановки
+    await order_journal.start()
+    # Модели грузятся в фоне: апдейты принимаются сразу, обработчик ждёт только то, что ему нужно
+    readiness.warm_up()
+
+
+async def shutdown():
+    logging.info(f"Scheduler: {scheduler.stats()}")
+    logging.info(f"Send limiter: {send_limiter.stats()}")
+    logging.info(f"Capabilities: {readiness.stats()}")
+    await readiness.close_all()
+    await order_journal.stop()
+    order_store.close()
+    await close_session()
+    await metrics.stop_metrics_server()
+
+
+async def main():
+    bot = create_bot(API_TOKEN)
+    dp = create_dispatcher()
+    await startup()
+    try:
+        # BOT_MODE=polling (по умолчанию) или webhook
+        await run_bot(dp, bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+# menu_index.py
+import os
+import re
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+MENU_MATCH_THRESHOLD = float(os.getenv('MENU_MATCH_THRESHOLD', '0.6'))
+NGRAM_SIZE = 3
+NGRAM_DIM = 4096
+# Слова, которые есть почти в каждом запросе и ничего не говорят о типе пиццы
+STOPWORDS = {"pizza", "pizzas", "a", "an", "the", "some", "please", "one"}
+
+
+def normalize(text: str) -> str:
+    words = re.findall(r"[a-z]+", text.lower())
+    return " ".join(w for w in words if w not in STOPWORDS)
+
+
+def ngram_vector(text: str) -> np.ndarray:
+    """L2-normalized hashed character n-gram counts; tolerant to typos like 'peperoni'"""
+    vector = np.zeros(NGRAM_DIM, dtype=np.float32)
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(len(padded) - NGRAM_SIZE + 1):
+            vector[zlib.crc32(padded[i:i + NGRAM_SIZE].encode()) % NGRAM_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MenuIndex:
+    """
+    Menu names prepared once for matching. Every query is a single matrix-vector
+    product against the character n-gram matrix (and against the word-vector
+    matrix when the spaCy model ships real vectors), so no parser runs per query.
+    """
+
+    def __init__(self, names: list, threshold: float = MENU_MATCH_THRESHOLD, vocab=None):
+        self.names = list(names)
+        self.threshold = threshold
+        self.keys = [normalize(name) for name in self.names]
+        self.exact = {key: i for i, key in enumerate(self.keys)}
+        self.ngrams = np.vstack([ngram_vector(key) for key in self.keys]) if self.names else np.zeros((0, NGRAM_DIM), dtype=np.float32)
+        # en_core_web_sm не содержит настоящих векторов — тогда работаем только по n-граммам
+        self.vocab = vocab if vocab is not None and vocab.vectors.shape[0] > 0 else None
+        self.vectors = _unit_rows(np.vstack([self._word_vector(key) for key in self.keys])) if self.vocab is not None and self.names else None
+
+    def _word_vector(self, text: str) -> np.ndarray:
+        words = [self.vocab[w] for w in text.split()]
+        words = [w.vector for w in words if w.has_vector]
+        if not words:
+            return np.zeros(self.vocab.vectors.shape[1], dtype=np.float32)
+        return np.mean(words, axis=0)
+
+    def scores(self, text: str) -> np.ndarray:
+        key = normalize(text)
+        if not self.names:
+            return np.zeros(0, dtype=np.float32)
+        scores = self.ngrams @ ngram_vector(key)
+        if self.vectors is not None:
+            query = self._word_vector(key)
+            norm = np.linalg.norm(query)
+            if norm:
+                scores = np.maximum(scores, self.vectors @ (query / norm))
+        if key in self.exact:
+            scores[self.exact[key]] = 1.0
+        return scores
+
+    def top_k(self, text: str, k: int = 3) -> list:
+        """[(menu name, score), ...] best first"""
+        scores = self.scores(text)
+        order = np.argsort(-scores)[:k]
+        return [(self.names[i], float(scores[i])) for i in order]
+
+    @metrics.timed("menu_match")
+    def best(self, text: str, threshold: float = None):
+        """Best menu name if its score reaches the threshold, else None"""
+        top = self.top_k(text, k=1)
+        if not top:
+            return None
+        name, score = top[0]
+        return name if score >= (self.threshold if threshold is None else threshold) else None
+
+
+_menu_index = None
+
+
+def get_menu_index() -> MenuIndex:
+    """Index over pizza.MENU, built on first use"""
+    global _menu_index
+    if _menu_index is None:
+        from pizza import MENU
+        from nlp_pipeline import get_nlp
+        _menu_index = MenuIndex([pizza["name"] for pizza in MENU], vocab=get_nlp().vocab)
+    return _menu_index
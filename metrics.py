@@ -0,0 +1,262 @@
+# metrics.py
+"""
+Minimal in-process metrics with a Prometheus text endpoint (GET /metrics).
+
+Stages are timed with @timed("stage") or `with timer("stage")`; each observation
+lands in bot_stage_seconds{stage, handler, outcome}, where handler is the aiogram
+handler currently running (set by HandlerMiddleware). Caches and other
+components expose their own counters through register_cache/register_gauge.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from aiogram import BaseMiddleware
+from dotenv import load_dotenv
+
+load_dotenv()
+# METRICS_HOST / METRICS_PORT читаются при запуске сервера, а не при импорте:
+# воркеры супервизора получают свой порт уже после того, как модуль загружен.
+# 0 — не поднимать HTTP-эндпоинт; 9100 обычно занят node_exporter
+DEFAULT_METRICS_PORT = 9821
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+current_handler = contextvars.ContextVar("current_handler", default="none")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [counts per bucket (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+# === Метрики бота ===
+stage_seconds = Histogram("bot_stage_seconds", "Time spent in a processing stage", ("stage", "handler", "outcome"))
+stage_errors = Counter("bot_stage_errors_total", "Stage calls that raised", ("stage", "handler"))
+in_flight = Gauge("bot_in_flight", "Stage calls currently running", ("stage",))
+_metrics = [stage_seconds, stage_errors, in_flight]
+_collectors = []
+_caches = {}
+
+
+def register(metric):
+    """Add a Counter/Gauge/Histogram created elsewhere to the endpoint"""
+    _metrics.append(metric)
+    return metric
+
+
+def register_gauge(name: str, help: str, read, label: str = "key", kind: str = "gauge"):
+    """Value read at scrape time; read() returns a number or a {label value: number} dict"""
+    _collectors.append((name, help, read, label, kind))
+
+
+def register_counter(name: str, help: str, read, label: str = "key"):
+    register_gauge(name, help, read, label, kind="counter")
+
+
+def register_cache(name: str, cache):
+    """Expose hits/misses/size of an LRUCache-like object with a stats() method"""
+    _caches[name] = cache
+
+
+def _render_collectors() -> list:
+    lines = []
+    if _caches:
+        stats = {name: cache.stats() for name, cache in _caches.items()}
+        for field, kind in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+            metric = f"bot_cache_{field}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {metric} Cache {field}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{cache="{name}"}} {values.get(field, 0)}' for name, values in stats.items()]
+    for name, help, read, label, kind in _collectors:
+        try:
+            value = read()
+        except Exception as e:
+            logging.error(f"Metric {name} failed: {e}")
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        if isinstance(value, dict):
+            lines += [f'{name}{{{label}="{_escape(key)}"}} {number}' for key, number in value.items()]
+        else:
+            lines.append(f"{name} {value}")
+    return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    lines += _render_collectors()
+    return "\n".join(lines) + "\n"
+
+
+# === Замеры ===
+def _finish(stage: str, started: float, outcome: str):
+    handler = current_handler.get()
+    stage_seconds.observe(time.perf_counter() - started, stage, handler, outcome)
+    if outcome == "error":
+        stage_errors.inc(stage, handler)
+
+
+class timer:
+    """`with timer("stage"):` records the duration of the block; an exception counts as an error"""
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        in_flight.inc(self.stage)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        in_flight.inc(self.stage, amount=-1)
+        _finish(self.stage, self.started, "ok" if exc_type is None else "error")
+        return False
+
+
+def timed(stage: str):
+    """Decorator that records every call of a sync or async function under `stage`"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class HandlerMiddleware(BaseMiddleware):
+    """Inner middleware: labels nested stages with the handler name and times the handler itself"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        token = current_handler.set(name)
+        try:
+            with timer("handler"):
+                return await handler(event, data)
+        finally:
+            current_handler.reset(token)
+
+
+# === HTTP ===
+_runner = None
+
+
+def metrics_port() -> int:
+    return int(os.getenv('METRICS_PORT', str(DEFAULT_METRICS_PORT)))
+
+
+async def start_metrics_server(host: str = None, port: int = None):
+    """Serve /metrics; a port that is already taken is logged and skipped, the bot keeps running"""
+    global _runner
+    host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+    port = metrics_port() if port is None else port
+    if not port or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logging.error(f"Metrics server not started on {host}:{port}: {e}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    logging.info(f"Metrics on http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,164 @@
+# nlp_pipeline.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+import metrics
+from batching import MicroBatcher
+
+load_dotenv()
+NLP_MODEL = os.getenv('NLP_MODEL', 'en_core_web_sm')
+# Компоненты, которые не нужны ни одному обработчику (NER нигде не используется)
+NLP_EXCLUDE = [name for name in os.getenv('NLP_EXCLUDE', 'ner').split(',') if name]
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', '32'))
+NLP_MAX_WAIT_MS = float(os.getenv('NLP_MAX_WAIT_MS', '5'))
+# 1 — nlp.pipe в отдельном потоке, N > 1 — постоянный пул из N процессов
+NLP_N_PROCESS = int(os.getenv('NLP_N_PROCESS', '1'))
+
+# Что ещё должно отработать, чтобы компонент дал правильный результат
+_REQUIRES = {
+    "tagger": {"tok2vec"},
+    "parser": {"tok2vec"},
+    "attribute_ruler": {"tagger"},
+    "lemmatizer": {"tagger", "attribute_ruler"},
+    "ner": {"tok2vec"},
+}
+
+# Наборы компонентов для типовых задач
+PARSE = ("parser", "attribute_ruler", "lemmatizer")   # зависимости + POS + леммы
+
+_nlp = None
+_lock = threading.Lock()
+
+
+def get_nlp():
+    """The process-wide spaCy pipeline, loaded on first use"""
+    global _nlp
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                # spaCy импортируется только здесь: сам импорт занимает заметное время
+                import spacy
+                logging.info(f"Loading spaCy model {NLP_MODEL} (excluding {NLP_EXCLUDE})")
+                _nlp = spacy.load(NLP_MODEL, exclude=NLP_EXCLUDE)
+    return _nlp
+
+
+def _expand(components) -> set:
+    needed = set()
+    stack = list(components)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(_REQUIRES.get(name, ()))
+    return needed
+
+
+def disabled_for(components) -> list:
+    """Pipe names that can be skipped when only `components` are needed"""
+    if components is None:
+        return []
+    needed = _expand(components)
+    return [name for name in get_nlp().pipe_names if name not in needed]
+
+
+@metrics.timed("nlp")
+def parse(text: str, components=PARSE):
+    """Run the shared pipeline on text, skipping components the caller doesn't need"""
+    return get_nlp()(text, disable=disabled_for(components))
+
+
+def tokenize(text: str):
+    """Tokenizer only — no tagger, parser or other statistical components run"""
+    return get_nlp().make_doc(text)
+
+
+def parse_many(texts: list, components=PARSE) -> list:
+    """Parse a batch of texts with nlp.pipe"""
+    return list(get_nlp().pipe(texts, batch_size=NLP_BATCH_SIZE, disable=disabled_for(components)))
+
+
+# === Батчевый разбор для асинхронных обработчиков ===
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    get_nlp()
+
+
+def _worker_parse(texts: list) -> bytes:
+    from spacy.tokens import DocBin
+    # Doc между процессами передаём через компактный DocBin
+    return DocBin(docs=parse_many(texts)).to_bytes()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["nlp_pipeline"])
+            _pool = ProcessPoolExecutor(max_workers=NLP_N_PROCESS, mp_context=ctx, initializer=_init_worker)
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_nlp():
+    """Load the pipeline (and start the worker pool if NLP_N_PROCESS > 1)"""
+    get_nlp()
+    if NLP_N_PROCESS > 1:
+        _get_pool()
+
+
+def stop_nlp():
+    global _pool
+    logging.info(f"NLP batches: {nlp_batcher.stats()}")
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run_parse_batch(texts: list) -> list:
+    if NLP_N_PROCESS <= 1:
+        return await asyncio.to_thread(parse_many, texts)
+    pool = _get_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(pool, _worker_parse, texts)
+    except BrokenProcessPool:
+        # Воркер умер — следующий батч получит новый пул, этот разбираем здесь же
+        logging.error("NLP worker died, restarting the pool")
+        _discard_pool(pool)
+        return await asyncio.to_thread(parse_many, texts)
+    from spacy.tokens import DocBin
+    return list(DocBin().from_bytes(data).get_docs(get_nlp().vocab))
+
+
+nlp_batcher = MicroBatcher(
+    _run_parse_batch,
+    max_batch_size=NLP_BATCH_SIZE,
+    max_wait=NLP_MAX_WAIT_MS / 1000,
+    concurrency=max(1, NLP_N_PROCESS),
+    name="nlp",
+)
+
+
+@metrics.timed("nlp")
+async def parse_async(text: str):
+    """Parse text off the event loop, batched with other concurrent messages"""
+    return await nlp_batcher.submit(text)
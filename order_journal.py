@@ -0,0 +1,228 @@
+# order_journal.py
+import asyncio
+import json
+import logging
+import os
+from dotenv import load_dotenv
+
+import metrics
+import order_store
+from order_store import Order
+
+load_dotenv()
+ORDER_JOURNAL_PATH = os.getenv('ORDER_JOURNAL_PATH', 'orders.journal')
+# Сколько ждать перед общим fsync: все заказы за это окно делят один fsync
+ORDER_FSYNC_WINDOW_MS = float(os.getenv('ORDER_FSYNC_WINDOW_MS', '5'))
+ORDER_FLUSH_BATCH = int(os.getenv('ORDER_FLUSH_BATCH', '200'))
+ORDER_FLUSH_INTERVAL = float(os.getenv('ORDER_FLUSH_INTERVAL', '0.5'))
+ORDER_FLUSH_RETRY = float(os.getenv('ORDER_FLUSH_RETRY', '5'))
+
+
+class OrderJournal:
+    """
+    Append-only, fsync-batched local journal of orders (one JSON object per line).
+    append() returns once the order is durable on local disk; a background
+    flusher drains it into the order store with multi-row INSERTs, one transaction per
+    batch. The byte offset of the last flushed entry is kept in `<path>.offset`,
+    so entries that never reached the database are replayed on startup.
+    """
+
+    def __init__(self, path: str = ORDER_JOURNAL_PATH, save_batch=None):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.save_batch = save_batch or order_store.save_orders
+        self._file = None
+        self._pending = []          # [(end_offset, Order)] ещё не в БД
+        self._synced = 0            # до этого байта журнал уже на диске
+        self._sync_waiters = []
+        self._sync_handle = None
+        self._flusher = None
+        self._wakeup = None
+        self._stopping = None
+        self._compacting = None     # future, пока обнулённый журнал ещё не сброшен на диск
+        self.appended = 0
+        self.flushed = 0
+        self.fsyncs = 0
+
+    # === Запуск и восстановление ===
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset: int):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _replay(self):
+        offset = self._read_offset()
+        if not os.path.exists(self.path):
+            return
+        if offset > os.path.getsize(self.path):
+            # Журнал обнулили, а отметку записать не успели
+            offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            position = offset
+            for line in f:
+                position += len(line)
+                if not line.endswith(b"\n"):
+                    # Оборванная последняя запись (падение во время write) — заказ не был подтверждён
+                    logging.warning(f"Dropping torn journal entry at offset {position - len(line)}")
+                    position -= len(line)
+                    break
+                self._pending.append((position, Order(**json.loads(line))))
+        if os.path.getsize(self.path) != position:
+            os.truncate(self.path, position)
+        self._synced = position
+        if self._pending:
+            logging.info(f"Replaying {len(self._pending)} unflushed orders from {self.path}")
+
+    async def start(self):
+        self._replay()
+        self._file = open(self.path, "ab", buffering=0)
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._flusher = asyncio.create_task(self._flush_loop(), name="order-journal-flusher")
+
+    async def stop(self):
+        """Final flush attempt; whatever is left stays in the journal for the next start"""
+        if self._flusher is not None:
+            # Не отменяем: прерванный save_batch всё равно доработал бы в потоке,
+            # и тот же пакет ушёл бы в БД второй раз из финального сброса
+            self._stopping.set()
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+        self._sync_now()
+        try:
+            await self._flush_once()
+        except Exception as e:
+            logging.error(f"Order journal: {len(self._pending)} orders left unflushed: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        logging.info(f"Order journal: {self.stats()}")
+
+    # === Запись ===
+    @metrics.timed("order_journal")
+    async def append(self, order: Order):
+        """Durably record an order; the database write happens later"""
+        if self._file is None:
+            raise RuntimeError("Order journal is not started")
+        line = json.dumps(order.as_dict(), ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        self._file.write(line)
+        self._pending.append((self._file.tell(), order))
+        self.appended += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._sync_waiters.append(waiter)
+        if self._sync_handle is None:
+            self._sync_handle = asyncio.get_running_loop().call_later(
+                ORDER_FSYNC_WINDOW_MS / 1000, lambda: asyncio.ensure_future(self._group_sync()))
+        await waiter
+
+    async def _group_sync(self):
+        if self._compacting is not None:
+            # Подтверждать новые записи можно только после того, как отметка 0 на диске
+            await self._compacting
+        self._sync_handle = None
+        waiters, self._sync_waiters = self._sync_waiters, []
+        upto = self._file.tell()
+        try:
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            self.fsyncs += 1
+            self._synced = max(self._synced, upto)
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        if len(self._pending) >= ORDER_FLUSH_BATCH:
+            self._wakeup.set()
+
+    def _sync_now(self):
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._synced = self._file.tell()
+        for waiter in self._sync_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._sync_waiters = []
+
+    # === Сброс в базу ===
+    async def _flush_once(self):
+        while self._pending:
+            # В БД уходит только то, что уже надёжно лежит в журнале
+            batch = [entry for entry in self._pending[:ORDER_FLUSH_BATCH] if entry[0] <= self._synced]
+            if not batch:
+                break
+            await self.save_batch([order for _, order in batch])
+            # Сдвигаем отметку только после commit в БД
+            await asyncio.to_thread(self._write_offset, batch[-1][0])
+            del self._pending[:len(batch)]
+            self.flushed += len(batch)
+        await self._compact()
+
+    async def _compact(self):
+        # Всё сброшено и ничего не ждёт fsync — журнал можно обнулить
+        if self._file is None or self._pending or self._sync_waiters or self._file.tell() == 0:
+            return
+        # Обрезаем здесь же, в цикле, чтобы новая запись не попала в отрезанный хвост;
+        # fsync и отметку пишем в потоке
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._synced = 0
+        self._compacting = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.to_thread(self._sync_truncated)
+        finally:
+            self._compacting.set_result(None)
+            self._compacting = None
+
+    def _sync_truncated(self):
+        os.fsync(self._file.fileno())
+        self._write_offset(0)
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), ORDER_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                await self._flush_once()
+            except Exception as e:
+                logging.error(f"Order journal flush failed, {len(self._pending)} orders pending: {e}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), ORDER_FLUSH_RETRY)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "appended": self.appended,
+            "flushed": self.flushed,
+            "pending": len(self._pending),
+            "fsyncs": self.fsyncs,
+        }
+
+
+journal = OrderJournal()
+metrics.register_gauge("bot_orders_pending", "Orders journaled but not yet in the database", lambda: len(journal._pending))
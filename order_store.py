@@ -0,0 +1,247 @@
+# order_store.py
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+# mysql — общий сервер, sqlite — встроенная база в файле (WAL), без сети
+ORDER_STORE = os.getenv('ORDER_STORE', 'mysql')
+DB_HOST = os.getenv('DB_HOST', '127.0.0.1')
+DB_PORT = int(os.getenv('DB_PORT', '3306'))
+DB_USER = os.getenv('DB_USER', 'root')
+DB_NAME = os.getenv('DB_NAME', 'mybot')
+DB_PASSWORD = os.getenv('DATABASE_PASSWORD')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+ORDER_SQLITE_PATH = os.getenv('ORDER_SQLITE_PATH', 'orders.db')
+
+
+@dataclass(frozen=True)
+class Order:
+    product: str
+    ptype: str
+    qty: int
+
+    @classmethod
+    def from_dict(cls, orderdict: dict) -> "Order":
+        required_keys = {'qty', 'product', 'ptype'}
+        if not required_keys.issubset(orderdict):
+            raise ValueError("Missing required keys")
+        return cls(product=orderdict["product"], ptype=orderdict["ptype"], qty=int(orderdict["qty"]))
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class OrderStore(ABC):
+    """Storage backend for orders. Methods are blocking; use the async helpers below from handlers."""
+
+    @abstractmethod
+    def save_orders(self, orders: list):
+        """Insert all orders in a single transaction"""
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class MySQLOrderStore(OrderStore):
+    def __init__(self, pool_size: int = DB_POOL_SIZE):
+        self.pool_size = pool_size
+        self.reconnects = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        from mysql.connector import pooling
+        with self._lock:
+            if self._pool is None:
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name="orders",
+                    pool_size=self.pool_size,
+                    pool_reset_session=False,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    database=DB_NAME,
+                )
+            return self._pool
+
+    @staticmethod
+    def _execute(cnx, orders: list):
+        # Все заказы — одним многострочным INSERT в одной транзакции.
+        # Обычный курсор: текст запроса меняется с размером пакета, так что серверный
+        # prepared statement не переиспользуется и стоит лишних PREPARE/DEALLOCATE на каждую запись
+        query = "INSERT INTO orders (product, ptype, qty) VALUES " + ", ".join(["(%s, %s, %s)"] * len(orders))
+        params = tuple(value for order in orders for value in (order.product, order.ptype, order.qty))
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(query, params)
+            cnx.commit()
+        finally:
+            cursor.close()
+
+    def save_orders(self, orders: list):
+        from mysql.connector import errors
+        cnx = self._get_pool().get_connection()
+        try:
+            try:
+                self._execute(cnx, orders)
+            except (errors.InterfaceError, errors.OperationalError) as e:
+                # Соединение могло умереть (рестарт MySQL, wait_timeout) — переподключаемся один раз
+                logging.warning(f"Order DB connection lost ({e}), reconnecting")
+                self.reconnects += 1
+                cnx.reconnect(attempts=3, delay=1)
+                self._execute(cnx, orders)
+        finally:
+            cnx.close()  # возвращает соединение в пул
+
+    def stats(self) -> dict:
+        return {"backend": "mysql", "reconnects": self.reconnects}
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            # У пула нет публичного close; _remove_connections закрывает все свободные соединения
+            pool._remove_connections()
+
+
+class SQLiteOrderStore(OrderStore):
+    def __init__(self, path: str = ORDER_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cnx = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._cnx.execute("PRAGMA journal_mode=WAL")
+        # В WAL-режиме NORMAL не теряет целостность, а fsync делается только на checkpoint
+        self._cnx.execute("PRAGMA synchronous=NORMAL")
+        self._cnx.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " id INTEGER PRIMARY KEY,"
+            " product TEXT NOT NULL,"
+            " ptype TEXT NOT NULL,"
+            " qty INTEGER NOT NULL,"
+            " created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        )
+
+    def save_orders(self, orders: list):
+        with self._lock:
+            self._cnx.execute("BEGIN")
+            try:
+                self._cnx.executemany(
+                    "INSERT INTO orders (product, ptype, qty) VALUES (?, ?, ?)",
+                    [(order.product, order.ptype, order.qty) for order in orders],
+                )
+                self._cnx.execute("COMMIT")
+            except Exception:
+                self._cnx.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._cnx.close()
+
+
+def create_order_store(kind: str = ORDER_STORE) -> OrderStore:
+    if kind == "mysql":
+        return MySQLOrderStore()
+    if kind == "sqlite":
+        return SQLiteOrderStore()
+    raise ValueError(f"Unknown order store: {kind}")
+
+
+# === Общий экземпляр, пул потоков и статистика ===
+_store = None
+_store_lock = threading.Lock()
+# Потоков ровно столько, сколько соединений: лишние запросы ждут в очереди, а не в базе
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="orders-db")
+_stats_lock = threading.Lock()
+_stats = {
+    "queries": 0,
+    "errors": 0,
+    "in_use": 0,
+    "waiting": 0,
+    "wait_total": 0.0,
+    "query_total": 0.0,
+}
+
+
+def get_store() -> OrderStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_order_store()
+        return _store
+
+
+def _bump(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+def stats() -> dict:
+    with _stats_lock:
+        result = dict(_stats)
+    queries = result["queries"] or 1
+    result["pool_size"] = DB_POOL_SIZE
+    result["avg_wait_ms"] = round(result.pop("wait_total") / queries * 1000, 2)
+    result["avg_query_ms"] = round(result.pop("query_total") / queries * 1000, 2)
+    if _store is not None:
+        result.update(_store.stats())
+    return result
+
+
+@metrics.timed("save_order_to_db")
+def save_orders_to_db(orders: list, queued_at: float = None):
+    """Insert several orders in one transaction (blocking)"""
+    started = time.perf_counter()
+    if queued_at is not None:
+        _bump(wait_total=started - queued_at)
+    _bump(in_use=1)
+    try:
+        get_store().save_orders(orders)
+    except Exception:
+        _bump(errors=1)
+        raise
+    finally:
+        _bump(in_use=-1, queries=1, query_total=time.perf_counter() - started)
+
+
+async def save_orders(orders: list):
+    """Insert a batch of orders in one transaction without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    _bump(waiting=1)
+    await loop.run_in_executor(_executor, _run_queued, orders, time.perf_counter())
+
+
+def _run_queued(orders: list, queued_at: float):
+    _bump(waiting=-1)
+    save_orders_to_db(orders, queued_at)
+
+
+metrics.register_gauge("bot_order_db_connections", "Order DB workers busy or waiting",
+                       lambda: {"in_use": _stats["in_use"], "waiting": _stats["waiting"]}, label="state")
+
+
+def close():
+    global _store
+    logging.info(f"Order DB: {stats()}")
+    _executor.shutdown(wait=True)
+    if _store is not None:
+        _store.close()
+        _store = None
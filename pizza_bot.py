@@ -1,22 +1,18 @@
 # pizza_bot.py
 import asyncio
 import logging
-import json
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import spacy
-import mysql.connector
-from mysql.connector import Error
-from dotenv import load_dotenv
-import os
 
-load_dotenv()
-DB_PASSWORD = os.getenv('DATABASE_PASSWORD')
+from order_journal import journal
+from order_store import Order
+from menu_index import get_menu_index
+from nlp_pipeline import parse, parse_async
+import readiness
 
-nlp = spacy.load("en_core_web_sm")
 logging.basicConfig(level=logging.INFO)
 router = Router()
 
@@ -27,44 +23,18 @@ class PizzaOrder(StatesGroup):
 
 def get_embedding(text: str):
     """Generate embedding for text using spaCy's word vectors"""
-    doc = nlp(text)
+    doc = parse(text)
     # Use the spaCy document vector
     return doc
 
 
 def find_best_pizza_match(user_input: str) -> str:
-    """Find the best matching pizza from the menu using spaCy similarity"""
-    from pizza import MENU
-    
-    # Create spaCy doc for user input
-    user_doc = nlp(user_input.lower())
-    
-    best_match = None
-    best_similarity = 0.0
-    
-    # Compare with each menu item
-    for pizza in MENU:
-        menu_doc = nlp(pizza["name"].lower())
-        
-        # Calculate similarity using spaCy's built-in similarity function
-        try:
-            similarity = user_doc.similarity(menu_doc)
-        except:
-            # Fallback if similarity calculation fails
-            similarity = 0.0
-        
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_match = pizza["name"]
-    
-    # Return the best match if similarity is above threshold
-    if best_similarity >= 0.88:
-        return best_match
-    else:
-        return None
+    """Find the best matching pizza from the menu (precomputed menu index)"""
+    return get_menu_index().best(user_input)
 
-def extract_pizza_type(text: str) -> str:
-    doc = nlp(text.lower())
+def extract_pizza_type(text: str, doc=None) -> str:
+    if doc is None:
+        doc = parse(text.lower())
     for token in doc:
         if token.lemma_ == "pizza":
             modifiers = []
@@ -103,32 +73,6 @@ def extract_quantity(text: str) -> int:
     # По умолчанию — 1
     return 1
 
-def save_order_to_db(orderdict: dict):
-    required_keys = {'qty', 'product', 'ptype'}
-    if not required_keys.issubset(orderdict):
-        raise ValueError("Missing required keys")
-
-    cnx = mysql.connector.connect(
-        user='root',
-        password=DB_PASSWORD,
-        host='127.0.0.1',
-        database='mybot'
-    )
-    query = """
-        INSERT INTO orders (product, ptype, qty)
-        SELECT product, ptype, qty FROM
-        JSON_TABLE(%s, "$" COLUMNS(
-            qty INT PATH '$.qty',
-            product VARCHAR(30) PATH "$.product",
-            ptype VARCHAR(30) PATH "$.ptype"
-        )) AS jt1
-    """
-    cursor = cnx.cursor()
-    cursor.execute(query, (json.dumps(orderdict),))
-    cnx.commit()
-    cursor.close()
-    cnx.close()
-
 # === ЕДИНСТВЕННАЯ команда для входа в заказ ===
 @router.message(Command("pizza"))
 async def start_pizza_order(message: Message, state: FSMContext):
@@ -142,7 +86,15 @@ async def start_pizza_order(message: Message, state: FSMContext):
 # === Шаг 1: Тип пиццы ===
 @router.message(PizzaOrder.waiting_for_type, F.text)
 async def get_pizza_type(message: Message, state: FSMContext):
-    pizza_type = extract_pizza_type(message.text)
+    try:
+        await readiness.wait("nlp")
+        doc = await parse_async(message.text.lower())
+    except Exception as e:
+        # Модель не загрузилась — остаёмся на этом шаге, следующая попытка повторит загрузку
+        logging.error(f"Pizza type error: {e}")
+        await message.answer("I couldn't understand. Try rephrasing.")
+        return
+    pizza_type = extract_pizza_type(message.text, doc)
     await state.update_data(ptype=pizza_type)
     await state.set_state(PizzaOrder.waiting_for_quantity)
     await message.answer(
@@ -162,6 +114,7 @@ async def get_pizza_quantity(message: Message, state: FSMContext):
         pizza_type = data["ptype"]
         
         # Check if pizza type matches menu items with similarity above 0.88
+        await readiness.wait("menu")
         matched_pizza = find_best_pizza_match(pizza_type)
         if not matched_pizza:
             await message.answer(f"❌ Sorry, we don't have '{pizza_type}' in our menu. Please choose from: Pepperoni, Margherita, or Vegetarian.")
@@ -169,14 +122,11 @@ async def get_pizza_quantity(message: Message, state: FSMContext):
             return
         
         # Use the matched pizza name from the menu
-        orderdict = {
-            "product": "pizza",
-            "ptype": matched_pizza,
-            "qty": qty
-        }
-        save_order_to_db(orderdict)
+        order = Order(product="pizza", ptype=matched_pizza, qty=qty)
+        # Заказ сразу пишется в локальный журнал, в базу его донесёт фоновый сброс
+        await journal.append(order)
 
-        summary = "\n".join(f"{k} - {v}" for k, v in orderdict.items())
+        summary = "\n".join(f"{k} - {v}" for k, v in order.as_dict().items())
         await message.answer(f"✅ Your order:\n{summary}\nThank you! 🍕")
         await state.clear()  # Возврат в универсальный режим
     except ValueError as e:
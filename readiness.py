@@ -0,0 +1,154 @@
+# readiness.py
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import threading
+import time
+
+import metrics
+
+
+class Capability:
+    """
+    Something slow to get ready (a model, a worker pool), loaded once in a
+    background thread. Everyone who needs it awaits the same load, so a
+    request arriving mid-warmup waits instead of starting a second load.
+    A failed load is retried on the next demand.
+    """
+
+    def __init__(self, name: str, load, stop=None):
+        self.name = name
+        self.load = load
+        self.stop = stop
+        self._future = None
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.load_seconds = None
+        self.error = None
+
+    @property
+    def state(self) -> str:
+        future = self._future
+        if future is None:
+            return "idle"
+        if not future.done():
+            return "loading"
+        return "failed" if future.exception() is not None else "ready"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> concurrent.futures.Future:
+        """Begin loading in the background unless it is loading or loaded already"""
+        with self._lock:
+            if self._future is None or (self._future.done() and self._future.exception() is not None):
+                self._future = concurrent.futures.Future()
+                self.started_at = time.perf_counter()
+                threading.Thread(target=self._run, name=f"warmup-{self.name}", daemon=True).start()
+            return self._future
+
+    def _run(self):
+        try:
+            self.load()
+        except BaseException as e:
+            self.error = e
+            logging.error(f"{self.name} failed to load: {e}")
+            self._future.set_exception(e)
+            return
+        self.load_seconds = time.perf_counter() - self.started_at
+        self.error = None
+        logging.info(f"{self.name} ready in {self.load_seconds:.1f}s")
+        self._future.set_result(None)
+
+    async def wait(self, timeout: float = None):
+        """Wait until loaded, starting the load if nobody has yet; raises if loading failed"""
+        future = self._future if self.ready else self.start()
+        if future.done():
+            return future.result()
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+    async def close(self, timeout: float = 60):
+        # Не загружалось или упало — останавливать нечего, а повторную загрузку при остановке не начинаем
+        if self.stop is None or self.state in ("idle", "failed"):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._future)), timeout)
+        except Exception:
+            return
+        result = self.stop()
+        if inspect.isawaitable(result):
+            await result
+
+
+capabilities = {}
+
+
+def register(name: str, load, stop=None) -> Capability:
+    capability = capabilities[name] = Capability(name, load, stop)
+    return capability
+
+
+def warm_up(*names):
+    """Start loading the given capabilities (all by default) without waiting"""
+    for name in names or capabilities:
+        capabilities[name].start()
+
+
+async def wait(name: str, timeout: float = None):
+    await capabilities[name].wait(timeout)
+
+
+async def close_all():
+    for capability in reversed(list(capabilities.values())):
+        try:
+            await capability.close()
+        except Exception as e:
+            logging.error(f"Failed to stop {capability.name}: {e}")
+
+
+def stats() -> dict:
+    return {
+        name: {"state": capability.state, "load_s": round(capability.load_seconds, 2) if capability.load_seconds else None}
+        for name, capability in capabilities.items()
+    }
+
+
+metrics.register_gauge("bot_capability_ready", "1 when the capability has finished loading",
+                       lambda: {name: int(capability.ready) for name, capability in capabilities.items()},
+                       label="capability")
+
+
+# === Возможности бота ===
+# Тяжёлые модули импортируются только здесь, в фоновом потоке
+def _load_nlp():
+    from nlp_pipeline import start_nlp
+    start_nlp()
+
+
+async def _stop_nlp():
+    from nlp_pipeline import nlp_batcher, stop_nlp
+    await nlp_batcher.close()
+    stop_nlp()
+
+
+def _load_menu():
+    from menu_index import get_menu_index
+    get_menu_index()
+
+
+def _load_caption():
+    from image import start_captioning
+    start_captioning()
+
+
+async def _stop_caption():
+    from image import caption_queue, stop_captioning
+    await caption_queue.close()
+    stop_captioning()
+
+
+NLP = register("nlp", _load_nlp, _stop_nlp)
+MENU = register("menu", _load_menu)
+CAPTION = register("caption", _load_caption, _stop_caption)
@@ -0,0 +1,101 @@
+# runner.py
+import asyncio
+import logging
+import os
+import secrets
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from dotenv import load_dotenv
+
+from send_limiter import send_limiter
+
+load_dotenv()
+# polling — long polling (как раньше), webhook — Telegram сам присылает апдейты на наш HTTP-сервер
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Необязательный адрес Bot API (например, локальная заглушка fake_telegram.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Без заданного секрета генерируем случайный: он уходит в set_webhook, и чужие POST-запросы отклоняются
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '40'))
+
+
+def create_bot(token: str) -> Bot:
+    if TELEGRAM_API_URL:
+        bot = Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    else:
+        bot = Bot(token=token)
+    # Все исходящие сообщения идут через общий ограничитель
+    bot.session.middleware(send_limiter)
+    return bot
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Outer update middleware: at most `limit` updates are handled at the same time"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+
+    async def __call__(self, handler, event, data):
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH,
+                       secret: str = WEBHOOK_SECRET, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY) -> web.Application:
+    """aiohttp app that verifies the secret token and feeds updates into the Dispatcher"""
+    if not secret:
+        raise RuntimeError("A webhook secret token is required")
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(max_concurrency))
+    app = web.Application()
+    # Ответ Telegram уходит только после обработки апдейта: в фоне принятые апдейты копились бы
+    # без предела, а так их число ограничено max_connections из set_webhook
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret,
+                         handle_in_background=False).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set in webhook mode")
+    app = create_webhook_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONCURRENCY,
+        drop_pending_updates=True,
+    )
+    logging.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def run_bot(dp: Dispatcher, bot: Bot, mode: str = BOT_MODE):
+    """Start receiving updates in the configured mode"""
+    if mode == "webhook":
+        await run_webhook(dp, bot)
+    elif mode == "polling":
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
+    else:
+        raise ValueError(f"Unknown BOT_MODE: {mode}")
@@ -0,0 +1,207 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+# Сколько сообщений обрабатывается одновременно; остальные ждут в очереди по приоритету
+SCHED_CONCURRENCY = int(os.getenv('SCHED_CONCURRENCY', '16'))
+SCHED_QUEUE_LIMIT = int(os.getenv('SCHED_QUEUE_LIMIT', '256'))
+# Сообщений одного чата в очереди и в работе одновременно
+SCHED_CHAT_LIMIT = int(os.getenv('SCHED_CHAT_LIMIT', '4'))
+# Сколько слотов могут занять фото: подпись BLIP держит слот до CAPTION_TIMEOUT
+SCHED_PHOTO_LIMIT = int(os.getenv('SCHED_PHOTO_LIMIT') or max(1, SCHED_CONCURRENCY // 4))
+# Отказ по перегрузке отправляем чату не чаще раза за это время, остальные сбрасываем молча
+SCHED_SHED_REPLY_INTERVAL = float(os.getenv('SCHED_SHED_REPLY_INTERVAL', '30'))
+
+# Меньше — важнее
+ORDER, TEXT, PHOTO = 0, 1, 2
+PRIORITY_NAMES = {ORDER: "order", TEXT: "text", PHOTO: "photo"}
+SHED_REPLIES = {
+    ORDER: "Sorry, I'm very busy right now. Please send that again in a moment.",
+    TEXT: "Sorry, I'm a bit overloaded right now. Please ask again in a minute.",
+    PHOTO: "Sorry, I'm getting too many photos right now. Please send it again a bit later.",
+}
+
+
+class Shed(Exception):
+    """The message was dropped by the scheduler"""
+
+
+def classify(message: Message, raw_state: str = None) -> int:
+    """Order steps and commands first, then text (Wikipedia), then photos (BLIP)"""
+    if raw_state and raw_state.startswith("PizzaOrder"):
+        return ORDER
+    if message.text and message.text.startswith("/"):
+        return ORDER
+    if message.photo:
+        return PHOTO
+    return TEXT
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer message middleware that bounds in-flight work. At most `concurrency`
+    handlers run at once; the rest wait in one priority queue (order steps,
+    then text, then photos, FIFO within a priority). Each chat may have at most
+    `chat_limit` messages queued or running, and photos never hold more than
+    `photo_limit` slots, so order steps always find one. When the queue is full,
+    a lower priority waiter is evicted to make room. A chat whose messages are
+    dropped gets one short reply per `reply_interval`; the rest go silently.
+    """
+
+    def __init__(self, concurrency: int = SCHED_CONCURRENCY, queue_limit: int = SCHED_QUEUE_LIMIT,
+                 chat_limit: int = SCHED_CHAT_LIMIT, photo_limit: int = SCHED_PHOTO_LIMIT,
+                 reply_interval: float = SCHED_SHED_REPLY_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue_limit)
+        self.chat_limit = max(1, chat_limit)
+        self.class_limits = {PHOTO: max(1, min(photo_limit, self.concurrency))}
+        self.reply_interval = reply_interval
+        self._waiting = []               # heap of [priority, seq, future]
+        self._seq = itertools.count()
+        self._per_chat = defaultdict(int)
+        self._replied = {}               # chat_id -> когда последний раз ответили отказом
+        self.running = 0
+        self.running_by = defaultdict(int)
+        self.started = defaultdict(int)
+        self.waited = defaultdict(float)
+        self.shed = defaultdict(int)     # (priority, reason) -> count
+
+    # === Очередь ===
+    def _can_start(self, priority: int) -> bool:
+        return (self.running < self.concurrency
+                and self.running_by[priority] < self.class_limits.get(priority, self.concurrency))
+
+    def _start(self, priority: int):
+        self.running += 1
+        self.running_by[priority] += 1
+
+    def _admit(self, priority: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # _release запускает всех, кого можно, поэтому в очереди остаются только те,
+        # кому не хватило слота или лимита своего класса
+        if self._can_start(priority):
+            self._start(priority)
+            future.set_result(None)
+            return future
+        if len(self._waiting) >= self.queue_limit:
+            victim = max(self._waiting, default=None)
+            if victim is None or victim[0] <= priority:
+                raise Shed("queue")
+            # Вытесняем самое свежее сообщение с самым низким приоритетом
+            self._waiting.remove(victim)
+            heapq.heapify(self._waiting)
+            victim[2].set_exception(Shed("evicted"))
+        heapq.heappush(self._waiting, [priority, next(self._seq), future])
+        return future
+
+    def _release(self, priority: int):
+        self.running -= 1
+        self.running_by[priority] -= 1
+        blocked = []
+        while self._waiting and self.running < self.concurrency:
+            entry = heapq.heappop(self._waiting)
+            if entry[2].done():
+                continue
+            if not self._can_start(entry[0]):
+                # Класс упёрся в свой лимит — пропускаем его к следующим по приоритету
+                blocked.append(entry)
+                continue
+            self._start(entry[0])
+            entry[2].set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._waiting, entry)
+
+    def _cancel(self, future: asyncio.Future):
+        for entry in self._waiting:
+            if entry[2] is future:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                return
+
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, Message):
+            return await handler(event, data)
+        priority = classify(event, data.get("raw_state"))
+        chat_id = event.chat.id
+        if self._per_chat[chat_id] >= self.chat_limit:
+            return await self._reject(event, priority, "chat")
+        queued_at = time.perf_counter()
+        try:
+            future = self._admit(priority)
+        except Shed as e:
+            return await self._reject(event, priority, str(e))
+        self._per_chat[chat_id] += 1
+        try:
+            try:
+                await future
+            except Shed as e:
+                return await self._reject(event, priority, str(e))
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(priority)
+                else:
+                    self._cancel(future)
+                raise
+            self.started[priority] += 1
+            self.waited[priority] += time.perf_counter() - queued_at
+            try:
+                return await handler(event, data)
+            finally:
+                self._release(priority)
+        finally:
+            self._per_chat[chat_id] -= 1
+            if not self._per_chat[chat_id]:
+                del self._per_chat[chat_id]
+
+    async def _reject(self, message: Message, priority: int, reason: str):
+        self.shed[priority, reason] += 1
+        logging.warning(f"Shed {PRIORITY_NAMES[priority]} message from chat {message.chat.id} ({reason})")
+        # Иначе спамер получает по ответу на каждое сообщение и забивает свою очередь отправки
+        now = time.monotonic()
+        last = self._replied.get(message.chat.id)
+        if last is not None and now - last < self.reply_interval:
+            return
+        if len(self._replied) >= 4096:
+            self._replied = {chat: at for chat, at in self._replied.items() if now - at < self.reply_interval}
+        self._replied[message.chat.id] = now
+        try:
+            await message.answer(SHED_REPLIES[priority])
+        except Exception as e:
+            logging.error(f"Failed to send overload reply: {e}")
+
+    # === Метрики ===
+    def depth(self) -> dict:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiting:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "running_by": {PRIORITY_NAMES[p]: n for p, n in self.running_by.items() if n},
+            "depth": self.depth(),
+            "chats": len(self._per_chat),
+            "started": {PRIORITY_NAMES[p]: n for p, n in self.started.items()},
+            "avg_wait_ms": {PRIORITY_NAMES[p]: round(self.waited[p] / n * 1000, 2) for p, n in self.started.items()},
+            "shed": {f"{PRIORITY_NAMES[p]}:{reason}": n for (p, reason), n in self.shed.items()},
+        }
+
+
+scheduler = UpdateScheduler()
+metrics.register_gauge("bot_scheduler_running", "Handlers running under the scheduler", lambda: scheduler.running)
+metrics.register_gauge("bot_scheduler_queue_depth", "Messages waiting, by priority", scheduler.depth, label="priority")
+metrics.register_counter("bot_scheduler_shed_total", "Messages dropped, by priority:reason",
+                         lambda: scheduler.stats()["shed"], label="reason")
@@ -1,10 +1,8 @@
 # search.py
-import spacy
-import wikipedia
-
-nlp = spacy.load("en_core_web_sm")
-wikipedia.set_lang("en")
+import metrics
+from wiki import search_wikipedia
 
+@metrics.timed("extract_keyphrase")
 def extract_keyphrase(doc):
     for token in doc:
         if token.dep_ == "pobj":
@@ -32,13 +30,3 @@ def extract_keyphrase(doc):
                 phrase += " " + " ".join(t.text for t in sorted(dobj_part, key=lambda x: x.i))
             return phrase.strip()
     return " ".join(t.text for t in doc if t.pos_ in ("NOUN", "PROPN", "VERB")) or str(doc)
-
-def search_wikipedia(query: str) -> str:
-    try:
-        return wikipedia.summary(query, sentences=1)
-    except wikipedia.exceptions.DisambiguationError as e:
-        return wikipedia.summary(e.options[0], sentences=1) if e.options else f"Too many meanings for '{query}'."
-    except wikipedia.exceptions.PageError:
-        return f"Nothing found about '{query}' in Wikipedia."
-    except Exception:
-        return "Sorry, Wikipedia search failed."
\ No newline at end of file
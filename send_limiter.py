@@ -0,0 +1,191 @@
+# send_limiter.py
+import asyncio
+import logging
+import os
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+# Лимиты Telegram: ~1 сообщение/с в личный чат, 20/мин в группу, ~30/с на бота
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_GROUP_BURST = float(os.getenv('SEND_GROUP_BURST', '3'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+# Сколько чатов держим в памяти, пока не начнём выбрасывать простаивающие
+SEND_MAX_CHATS = int(os.getenv('SEND_MAX_CHATS', '4096'))
+
+# Методы, которые отправляют или меняют сообщения в чате
+LIMITED_METHODS = {"copyMessage", "editMessageText", "editMessageCaption", "editMessageMedia", "forwardMessage"}
+
+
+def global_rate() -> float:
+    # Общий лимит читается при первой отправке, а не при импорте: воркер супервизора
+    # получает свою долю в окружении уже после того, как модуль загружен
+    return float(os.getenv('SEND_GLOBAL_RATE', '30'))
+
+
+def global_burst() -> float:
+    return float(os.getenv('SEND_GLOBAL_BURST', '30'))
+
+
+class TokenBucket:
+    """Token bucket where callers reserve a token and are told how long to wait for it"""
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token (possibly going into debt); returns seconds to wait before using it"""
+        self._refill()
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def try_take(self) -> float:
+        """Take a token if one is available; otherwise return seconds until one is"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+def is_limited(method) -> bool:
+    name = method.__api_method__
+    return getattr(method, "chat_id", None) is not None and (name.startswith("send") or name in LIMITED_METHODS)
+
+
+def chat_bucket(chat_id) -> TokenBucket:
+    # Отрицательные id — группы и каналы, у них лимит строже
+    if isinstance(chat_id, int) and chat_id < 0:
+        return TokenBucket(SEND_GROUP_RATE, SEND_GROUP_BURST)
+    return TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+
+
+class SendLimiter(BaseRequestMiddleware):
+    """
+    Bot session middleware that paces outgoing messages. Sends to one chat go
+    out strictly in FIFO order through that chat's token bucket, then through
+    a global bucket shared by all chats. A 429 from Telegram pauses the chat
+    for retry_after seconds and the message is sent again, so handlers never
+    see flood errors unless retries run out.
+    """
+
+    def __init__(self, global_rate: float = None, global_burst: float = None,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self._global_bucket = None
+        self.max_retries = max_retries
+        self._chats = {}     # chat_id -> [TokenBucket, asyncio.Lock, ожидающих]
+        self.sent = 0
+        self.delayed = 0
+        self.retries = 0
+        self.failed = 0
+        self.paced = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+
+    @property
+    def global_bucket(self) -> TokenBucket:
+        if self._global_bucket is None:
+            self._global_bucket = TokenBucket(
+                global_rate() if self.global_rate is None else self.global_rate,
+                global_burst() if self.global_burst is None else self.global_burst,
+            )
+        return self._global_bucket
+
+    async def __call__(self, make_request, bot, method):
+        if not is_limited(method):
+            return await make_request(bot, method)
+        chat_id = method.chat_id
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= SEND_MAX_CHATS:
+                self._prune()
+            chat = self._chats[chat_id] = [chat_bucket(chat_id), asyncio.Lock(), 0]
+        chat[2] += 1
+        queued_at = time.monotonic()
+        try:
+            async with chat[1]:
+                await self._wait(chat[0].reserve())
+                await self._wait(self.global_bucket.reserve())
+                self._record(time.monotonic() - queued_at)
+                return await self._send(make_request, bot, method)
+        finally:
+            chat[2] -= 1
+            if not chat[2] and chat[0].full():
+                del self._chats[chat_id]
+
+    def _prune(self):
+        # Чат без очереди и с полным ведром ничем не отличается от нового
+        for chat_id in [chat_id for chat_id, chat in self._chats.items() if not chat[2] and chat[0].full()]:
+            del self._chats[chat_id]
+
+    @staticmethod
+    async def _wait(delay: float):
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, make_request, bot, method):
+        attempt = 0
+        while True:
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retries += 1
+                logging.warning(f"Flood limit in chat {method.chat_id}, retrying in {e.retry_after}s")
+                # Блокировка чата удерживается — его следующие сообщения ждут за этим
+                await asyncio.sleep(e.retry_after)
+                await self._wait(self.global_bucket.reserve())
+
+    def _record(self, delay: float):
+        send_delay.observe(delay)
+        self.paced += 1
+        if delay > 0.001:
+            self.delayed += 1
+        self.delay_total += delay
+        self.delay_max = max(self.delay_max, delay)
+
+    def stats(self) -> dict:
+        queued = sum(chat[2] for chat in self._chats.values())
+        return {
+            "sent": self.sent,
+            "queued": queued,
+            "delayed": self.delayed,
+            "retries": self.retries,
+            "failed": self.failed,
+            "avg_delay_ms": round(self.delay_total / self.paced * 1000, 2) if self.paced else 0.0,
+            "max_delay_ms": round(self.delay_max * 1000, 2),
+        }
+
+
+send_delay = metrics.register(metrics.Histogram("bot_send_delay_seconds", "Time an outgoing message waited for rate limits"))
+send_limiter = SendLimiter()
+metrics.register_gauge("bot_send_queued", "Outgoing messages waiting for rate limits", lambda: send_limiter.stats()["queued"])
+metrics.register_counter("bot_send_total", "Outgoing messages by result",
+                         lambda: {"sent": send_limiter.sent, "retried": send_limiter.retries, "failed": send_limiter.failed},
+                         label="result")
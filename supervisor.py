@@ -0,0 +1,319 @@
+# supervisor.py
+"""
+Multi-process entry point: python supervisor.py
+
+The supervisor receives updates (polling or webhook, see BOT_MODE in runner.py)
+and hands each one to worker number crc32(chat_id) % SHARD_WORKERS. Every worker
+runs the usual Dispatcher from SHARD_APP (main or main_bot), so all updates of
+one chat land in the same process, in order, and its FSM hot tier stays valid.
+Each worker keeps its own FSM database and order journal (`<path>.<n>`), so
+changing SHARD_WORKERS drops conversations that were in progress. Every worker
+loads its own models, so keep SHARD_WORKERS small (default 2).
+Crashed workers are restarted; per-worker load is logged periodically.
+"""
+import asyncio
+import hmac
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from aiohttp import web
+from dotenv import load_dotenv
+
+import metrics
+import runner
+import send_limiter
+
+load_dotenv()
+# Каждый воркер держит свои BLIP и spaCy в памяти, поэтому по умолчанию их немного, а не по числу ядер
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '2'))
+SHARD_APP = os.getenv('SHARD_APP', 'main')
+SHARD_REPORT_INTERVAL = float(os.getenv('SHARD_REPORT_INTERVAL', '30'))
+SHARD_RESTART_DELAY = float(os.getenv('SHARD_RESTART_DELAY', '1'))
+API_TOKEN = os.getenv('BOT_API_KEY')
+
+
+def shard_key(update: dict) -> int:
+    """chat_id of an update (user id for events without a chat)"""
+    for name, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def shard_for(update: dict, workers: int) -> int:
+    return zlib.crc32(str(shard_key(update)).encode()) % workers
+
+
+# === Рабочий процесс ===
+class _Shard:
+    """Feeds updates into the Dispatcher; updates of one chat run strictly one after another"""
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        self._chats = {}     # chat_id -> [asyncio.Lock, апдейтов в работе]
+        self._tasks = set()
+        self.handled = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def submit(self, update: dict):
+        chat_id = shard_key(update)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = [asyncio.Lock(), 0]
+        chat[1] += 1
+        task = asyncio.create_task(self._handle(chat_id, chat, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, chat_id, chat: list, update: dict):
+        # asyncio.Lock будит ожидающих по очереди — порядок апдейтов чата сохраняется
+        async with chat[0]:
+            started = time.perf_counter()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Update {update.get('update_id')} failed: {e}")
+            finally:
+                self.handled += 1
+                self.busy += time.perf_counter() - started
+        chat[1] -= 1
+        if chat[1] == 0:
+            del self._chats[chat_id]
+
+    async def drain(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "handled": self.handled,
+            "errors": self.errors,
+            "in_flight": len(self._tasks),
+            "chats": len(self._chats),
+            "busy_s": round(self.busy, 2),
+        }
+
+
+async def _worker(index: int, app_name: str, updates, reports):
+    app = importlib.import_module(app_name)
+    bot = runner.create_bot(API_TOKEN)
+    dp = app.create_dispatcher()
+    await app.startup()
+    await dp.emit_startup(bot=bot)
+    loop = asyncio.get_running_loop()
+    shard = _Shard(dp, bot)
+    stopped = loop.create_future()
+
+    def read_updates():
+        while True:
+            update = updates.get()
+            if update is None:
+                loop.call_soon_threadsafe(stopped.set_result, None)
+                return
+            loop.call_soon_threadsafe(shard.submit, update)
+
+    async def report():
+        while True:
+            reports.put((index, os.getpid(), shard.stats()))
+            await asyncio.sleep(min(SHARD_REPORT_INTERVAL, 5))
+
+    threading.Thread(target=read_updates, name="shard-reader", daemon=True).start()
+    reporter = asyncio.create_task(report())
+    logging.info(f"Worker {index} (pid {os.getpid()}) ready")
+    try:
+        await stopped
+        await shard.drain()
+    finally:
+        reporter.cancel()
+        reports.put((index, os.getpid(), shard.stats()))
+        await dp.emit_shutdown(bot=bot)
+        await app.shutdown()
+        await bot.session.close()
+
+
+def _worker_main(index: int, workers: int, app_name: str, updates, reports):
+    # Останавливает воркеров супервизор (через очередь), а не Ctrl+C всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # У каждого воркера свой журнал заказов и своя база FSM: чистка по `touched` в общей базе
+    # удаляла бы сессии, которые другой воркер ещё держит в горячем слое
+    os.environ['ORDER_JOURNAL_PATH'] = f"{os.getenv('ORDER_JOURNAL_PATH', 'orders.journal')}.{index}"
+    os.environ['FSM_DB_PATH'] = f"{os.getenv('FSM_DB_PATH', 'fsm.db')}.{index}"
+    # Подписи к фото считаем в самом воркере
+    os.environ.setdefault('CAPTION_WORKERS', '0')
+    # Лимит Telegram на бота общий, а ведро у каждого воркера своё — делим его поровну
+    os.environ['SEND_GLOBAL_RATE'] = str(send_limiter.global_rate() / workers)
+    os.environ['SEND_GLOBAL_BURST'] = str(send_limiter.global_burst() / workers)
+    # Метрики воркера n — на METRICS_PORT + 1 + n
+    metrics_port = metrics.metrics_port()
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + 1 + index)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [worker {index}] %(levelname)s %(message)s")
+    asyncio.run(_worker(index, app_name, updates, reports))
+
+
+# === Супервизор ===
+class Supervisor:
+    def __init__(self, workers: int = SHARD_WORKERS, app_name: str = SHARD_APP):
+        self.workers = max(1, workers)
+        self.app_name = app_name
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [None] * self.workers
+        self.reports = self._ctx.Queue()
+        self.processes = [None] * self.workers
+        self.forwarded = [0] * self.workers
+        self.restarts = [0] * self.workers
+        self.loads = [{} for _ in range(self.workers)]
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        # Новая очередь на каждый запуск: упавший процесс мог умереть, держа блокировку старой
+        self.queues[index] = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.workers, self.app_name, self.queues[index], self.reports),
+            name=f"shard-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        threading.Thread(target=self._read_reports, name="shard-reports", daemon=True).start()
+
+    def route(self, update: dict):
+        index = shard_for(update, self.workers)
+        self.queues[index].put(update)
+        self.forwarded[index] += 1
+
+    def _read_reports(self):
+        while True:
+            report = self.reports.get()
+            if report is None:
+                return
+            index, pid, stats = report
+            self.loads[index] = dict(stats, pid=pid)
+
+    async def watch(self):
+        """Restart workers that died and log per-worker load"""
+        last_report = time.monotonic()
+        while not self._stopping:
+            await asyncio.sleep(SHARD_RESTART_DELAY)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and not process.is_alive():
+                    logging.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                                  f"restarting; {self._queued(index)} queued updates lost")
+                    self.restarts[index] += 1
+                    self._spawn(index)
+            if time.monotonic() - last_report >= SHARD_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                logging.info(f"Shards: {self.stats()}")
+
+    def _queued(self, index: int) -> int:
+        try:
+            return self.queues[index].qsize()
+        except NotImplementedError:
+            return -1
+
+    def stats(self) -> list:
+        return [
+            dict(self.loads[index], worker=index, forwarded=self.forwarded[index],
+                 queued=self._queued(index), restarts=self.restarts[index])
+            for index in range(self.workers)
+        ]
+
+    def stop(self, timeout: float = 30):
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(f"Worker {process.name} did not stop in time, terminating")
+                process.terminate()
+                process.join()
+        self.reports.put(None)
+        logging.info(f"Shards: {self.stats()}")
+
+
+async def _poll(bot, supervisor: Supervisor):
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except Exception as e:
+            logging.error(f"Failed to fetch updates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            supervisor.route(update.model_dump(mode="json", exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(bot, supervisor: Supervisor):
+    if not runner.WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set in webhook mode")
+
+    async def receive(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), runner.WEBHOOK_SECRET.encode()):
+            return web.Response(status=401, text="Unauthorized")
+        supervisor.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(runner.WEBHOOK_PATH, receive)
+    app_runner = web.AppRunner(app)
+    await app_runner.setup()
+    await web.TCPSite(app_runner, runner.WEBHOOK_HOST, runner.WEBHOOK_PORT).start()
+    await bot.set_webhook(
+        runner.WEBHOOK_URL.rstrip("/") + runner.WEBHOOK_PATH,
+        secret_token=runner.WEBHOOK_SECRET,
+        max_connections=runner.WEBHOOK_MAX_CONCURRENCY,
+        drop_pending_updates=True,
+    )
+    logging.info(f"Webhook server listening on {runner.WEBHOOK_HOST}:{runner.WEBHOOK_PORT}{runner.WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await app_runner.cleanup()
+
+
+async def main():
+    supervisor = Supervisor()
+    supervisor.start()
+    logging.info(f"Started {supervisor.workers} workers running {supervisor.app_name}")
+    # Этот бот только принимает апдейты; отвечают воркеры
+    bot = runner.create_bot(API_TOKEN)
+    receive = _serve_webhook if runner.BOT_MODE == "webhook" else _poll
+    watcher = asyncio.create_task(supervisor.watch())
+    try:
+        await receive(bot, supervisor)
+    finally:
+        watcher.cancel()
+        await asyncio.to_thread(supervisor.stop)
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
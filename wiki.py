@@ -0,0 +1,213 @@
+# wiki.py
+import asyncio
+import logging
+import os
+from html.parser import HTMLParser
+import aiohttp
+from dotenv import load_dotenv
+
+import metrics
+from cache import SingleFlight, TTLCache
+from wiki_index import open_index
+
+load_dotenv()
+WIKI_API_URL = os.getenv('WIKI_API_URL', 'https://en.wikipedia.org/w/api.php')
+WIKI_TIMEOUT = float(os.getenv('WIKI_TIMEOUT', '5'))
+WIKI_POOL_SIZE = int(os.getenv('WIKI_POOL_SIZE', '20'))
+WIKI_CACHE_SIZE = int(os.getenv('WIKI_CACHE_SIZE', '5000'))
+WIKI_CACHE_TTL = float(os.getenv('WIKI_CACHE_TTL', '86400'))
+# "Ничего не найдено" живёт в кэше меньше, чем найденные статьи
+WIKI_NEGATIVE_TTL = float(os.getenv('WIKI_NEGATIVE_TTL', '900'))
+# remote — только живая Википедия, local — только локальный индекс,
+# local-first — сначала индекс, при промахе идём в сеть
+WIKI_BACKEND = os.getenv('WIKI_BACKEND', 'remote')
+WIKI_INDEX_PATH = os.getenv('WIKI_INDEX_PATH', 'wiki_index.db')
+USER_AGENT = "tg_bot/1.0 (https://github.com/zombienok/tg_bot)"
+
+
+class PageError(Exception):
+    """No Wikipedia page matches the query"""
+
+    def __init__(self, query: str):
+        super().__init__(f"Page not found: {query}")
+        self.query = query
+
+
+class DisambiguationError(Exception):
+    """The query resolves to a disambiguation page"""
+
+    def __init__(self, title: str, options: list):
+        super().__init__(f"'{title}' may refer to: {', '.join(options[:5])}")
+        self.title = title
+        self.options = options
+
+
+# === Одна сессия (пул соединений) на процесс ===
+_session = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=WIKI_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=WIKI_TIMEOUT),
+            headers={"User-Agent": USER_AGENT},
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    logging.info(f"Wikipedia cache: {summary_cache.stats()}, coalescing: {summary_flight.stats()}")
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _api(params: dict, timeout: float = None) -> dict:
+    params = {**params, "format": "json", "formatversion": "2"}
+    # Без явного timeout действует WIKI_TIMEOUT сессии (timeout=None его бы отключил)
+    kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+    async with _get_session().get(WIKI_API_URL, params=params, **kwargs) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def _resolve_title(query: str, timeout: float = None) -> str:
+    """Same as wikipedia.summary(auto_suggest=True): best search hit or suggestion"""
+    data = await _api({
+        "action": "query",
+        "list": "search",
+        "srsearch": query,
+        "srlimit": 1,
+        "srprop": "",
+        "srinfo": "suggestion",
+    }, timeout)
+    result = data.get("query", {})
+    suggestion = result.get("searchinfo", {}).get("suggestion")
+    hits = result.get("search", [])
+    if suggestion:
+        return suggestion
+    if hits:
+        return hits[0]["title"]
+    raise PageError(query)
+
+
+class _ListItemLinks(HTMLParser):
+    """Text of the first link in every <li>, in page order (what wikipedia.DisambiguationError listed)"""
+
+    def __init__(self):
+        super().__init__()
+        self.options = []
+        self._items = []     # для каждого открытого <li>: [ссылка уже взята, текст текущей ссылки или None]
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "li":
+            # Пункты оглавления — не значения слова
+            self._items.append([("tocsection" in (dict(attrs).get("class") or "")), None])
+        elif tag == "a" and self._items and not self._items[-1][0]:
+            self._items[-1][1] = []
+
+    def handle_data(self, data):
+        if self._items and self._items[-1][1] is not None:
+            self._items[-1][1].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._items and self._items[-1][1] is not None:
+            self.options.append("".join(self._items[-1][1]))
+            self._items[-1] = [True, None]
+        elif tag == "li" and self._items:
+            self._items.pop()
+
+
+async def _disambiguation_options(title: str, timeout: float = None) -> list:
+    # prop=links отдаёт ссылки по алфавиту вместе с «См. также»; порядок значений есть только в разметке страницы
+    data = await _api({
+        "action": "parse",
+        "page": title,
+        "prop": "text",
+        "disableeditsection": 1,
+    }, timeout)
+    parser = _ListItemLinks()
+    parser.feed(data.get("parse", {}).get("text", ""))
+    parser.close()
+    return parser.options
+
+
+async def fetch_summary(query: str, sentences: int = 1, timeout: float = None) -> str:
+    """
+    Return the first sentences of the article best matching `query`.
+    Raises PageError or DisambiguationError like the `wikipedia` package.
+    """
+    title = await _resolve_title(query, timeout)
+    data = await _api({
+        "action": "query",
+        "prop": "extracts|pageprops",
+        "ppprop": "disambiguation",
+        "explaintext": 1,
+        "exintro": 1,
+        "exsentences": sentences,
+        "redirects": 1,
+        "titles": title,
+    }, timeout)
+    pages = data.get("query", {}).get("pages", [])
+    if not pages or pages[0].get("missing") or pages[0].get("invalid"):
+        raise PageError(query)
+    page = pages[0]
+    if "disambiguation" in page.get("pageprops", {}):
+        raise DisambiguationError(page["title"], await _disambiguation_options(page["title"], timeout))
+    return page.get("extract", "")
+
+
+# === Кэш ответов ===
+summary_cache = TTLCache(maxsize=WIKI_CACHE_SIZE, ttl=WIKI_CACHE_TTL)
+# Одинаковые запросы, пришедшие одновременно, делят один поход в сеть
+summary_flight = SingleFlight()
+metrics.register_cache("wiki_summary", summary_cache)
+
+local_index = open_index(WIKI_INDEX_PATH) if WIKI_BACKEND in ("local", "local-first") else None
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+@metrics.timed("search_wikipedia")
+async def search_wikipedia(query: str, timeout: float = WIKI_TIMEOUT) -> str:
+    key = normalize_query(query)
+    answer = summary_cache.get(key)
+    if answer is not None:
+        return answer
+    return await summary_flight.do(key, lambda: _lookup(query, key, timeout))
+
+
+async def _lookup(query: str, key: str, timeout: float) -> str:
+    if local_index is not None:
+        answer = local_index.lookup(query)
+        if answer is not None:
+            summary_cache.set(key, answer)
+            return answer
+    if WIKI_BACKEND == "local":
+        answer = f"Nothing found about '{query}' in Wikipedia."
+        summary_cache.set(key, answer, WIKI_NEGATIVE_TTL)
+        return answer
+
+    ttl = WIKI_CACHE_TTL
+    try:
+        answer = await fetch_summary(query, timeout=timeout)
+    except DisambiguationError as e:
+        if e.options:
+            answer = await fetch_summary(e.options[0], timeout=timeout)
+        else:
+            answer, ttl = f"Too many meanings for '{query}'.", WIKI_NEGATIVE_TTL
+    except PageError:
+        answer, ttl = f"Nothing found about '{query}' in Wikipedia.", WIKI_NEGATIVE_TTL
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Сетевые ошибки не кэшируем
+        logging.error(f"Wikipedia search failed for '{query}': {e}")
+        return "Sorry, Wikipedia search failed."
+    summary_cache.set(key, answer, ttl)
+    return answer
@@ -0,0 +1,160 @@
+# wiki_index.py
+"""
+Offline Wikipedia summary index (SQLite + FTS5).
+
+Build it once from a JSONL extract or a Wikipedia abstract dump:
+
+    python wiki_index.py enwiki-abstract.xml.gz wiki_index.db
+    python wiki_index.py articles.jsonl wiki_index.db
+
+JSONL lines look like {"title": "Paris", "text": "Paris is ..."} or
+{"title": "Paris, France", "redirect": "Paris"} for redirects.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import xml.etree.ElementTree as ET
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    norm TEXT NOT NULL UNIQUE,
+    lead TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS redirects (
+    norm TEXT PRIMARY KEY,
+    target TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    title, content='pages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_DISAMBIGUATION = re.compile(r"\bmay (also )?refer to\b")
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.replace("_", " ").lower().split())
+
+
+def lead_sentence(text: str) -> str:
+    text = " ".join(text.split())
+    return _SENTENCE_END.split(text, maxsplit=1)[0] if text else ""
+
+
+def _open(path: str):
+    return gzip.open(path, "rt", encoding="utf-8") if path.endswith(".gz") else open(path, encoding="utf-8")
+
+
+def _read_jsonl(path: str):
+    with _open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("redirect"):
+                yield record["title"], None, record["redirect"]
+            else:
+                yield record["title"], record.get("text", ""), None
+
+
+def _read_abstract_dump(path: str):
+    """enwiki-*-abstract.xml: <doc><title>Wikipedia: X</title><abstract>...</abstract></doc>"""
+    with _open(path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag != "doc":
+                continue
+            title = (elem.findtext("title") or "").removeprefix("Wikipedia: ")
+            abstract = elem.findtext("abstract") or ""
+            elem.clear()
+            if title:
+                yield title, abstract, None
+
+
+def build_index(source_path: str, db_path: str) -> int:
+    """Create (or extend) the index at db_path; returns the number of pages added"""
+    records = _read_abstract_dump(source_path) if ".xml" in source_path else _read_jsonl(source_path)
+    con = sqlite3.connect(db_path)
+    con.executescript(SCHEMA)
+    pages = 0
+    with con:
+        for title, text, redirect in records:
+            norm = normalize_title(title)
+            if redirect:
+                con.execute("INSERT OR REPLACE INTO redirects (norm, target) VALUES (?, ?)",
+                            (norm, normalize_title(redirect)))
+                continue
+            lead = lead_sentence(text)
+            if not lead or _DISAMBIGUATION.search(lead):
+                continue
+            con.execute("INSERT OR REPLACE INTO pages (title, norm, lead) VALUES (?, ?, ?)", (title, norm, lead))
+            pages += 1
+        con.execute("INSERT INTO pages_fts(pages_fts) VALUES ('rebuild')")
+    con.execute("VACUUM")
+    con.close()
+    return pages
+
+
+class LocalWikiIndex:
+    """Read-only lookups against an index built by build_index"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        # Индекс отображается в память — чтения без системных вызовов read()
+        self.con.execute("PRAGMA mmap_size = 1073741824")
+        self.con.execute("PRAGMA query_only = 1")
+
+    def close(self):
+        self.con.close()
+
+    def _by_norm(self, norm: str):
+        row = self.con.execute("SELECT lead FROM pages WHERE norm = ?", (norm,)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, query: str):
+        """Lead sentence for `query` or None: exact title, then redirect, then full-text match"""
+        norm = normalize_title(query)
+        if not norm:
+            return None
+        lead = self._by_norm(norm)
+        if lead is not None:
+            return lead
+        row = self.con.execute("SELECT target FROM redirects WHERE norm = ?", (norm,)).fetchone()
+        if row:
+            lead = self._by_norm(row[0])
+            if lead is not None:
+                return lead
+        # Заголовок должен содержать все слова запроса: совпадение по одному слову
+        # почти всегда находит чужую статью, и тогда лучше спросить удалённую Википедию
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in norm.split())
+        row = self.con.execute(
+            "SELECT pages.lead FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid "
+            "WHERE pages_fts MATCH ? ORDER BY rank LIMIT 1",
+            (match,),
+        ).fetchone()
+        return row[0] if row else None
+
+
+def open_index(db_path: str):
+    """LocalWikiIndex for db_path, or None if the file is missing"""
+    if not db_path or not os.path.exists(db_path):
+        logging.warning(f"Local Wikipedia index not found: {db_path}")
+        return None
+    return LocalWikiIndex(db_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python wiki_index.py <abstract.xml[.gz] | extract.jsonl[.gz]> <index.db>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    count = build_index(sys.argv[1], sys.argv[2])
+    logging.info(f"Indexed {count} pages into {sys.argv[2]}")